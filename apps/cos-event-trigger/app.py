@@ -1,9 +1,18 @@
 #!/usr/bin/env python3
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, g
 import json
 import os
+import codecs
+import gzip
+import signal
+import socket
+import sys
+import threading
+import time
 import httpx
+from collections import OrderedDict
 from datetime import datetime
+from prometheus_client import Counter, Gauge, Histogram, generate_latest, CONTENT_TYPE_LATEST
 
 app = Flask(__name__)
 
@@ -14,29 +23,128 @@ IBM_APP_NAME = os.environ.get("CE_APP", "cos-event-trigger")
 IBM_SUBSYSTEM_NAME = os.environ.get("CE_PROJECT_ID", "event-processor")
 IBM_LOG_SEVERITY = os.environ.get("IBM_LOG_SEVERITY", "info")
 
+# Stats snapshot configuration. Point STATS_SNAPSHOT_PATH at a mounted volume
+# (for example a COS bucket mounted as a Code Engine persistent data store)
+# so counts survive scale-to-zero. Instances sharing the volume each add the
+# counts they recorded since their last write to the file, see save_stats_snapshot.
+STATS_SNAPSHOT_PATH = os.environ.get("STATS_SNAPSHOT_PATH")
+STATS_SNAPSHOT_INTERVAL = float(os.environ.get("STATS_SNAPSHOT_INTERVAL", "30"))
+
+# Number of recent event IDs remembered for duplicate suppression
+DEDUP_CACHE_SIZE = int(os.environ.get("DEDUP_CACHE_SIZE", "10000"))
+
+# /batch forwards the log lines of accepted events to IBM Cloud Logging in
+# requests of at most this many lines while the body is still streaming in
+BATCH_LOG_SIZE = int(os.environ.get("BATCH_LOG_SIZE", "500"))
+
+# Coalesced job dispatch. When DISPATCH_JOB_NAME is set, matching events are
+# grouped by bucket (or bucket and key prefix) and one job run is submitted per
+# group once the window elapses or the group reaches DISPATCH_MAX_EVENTS.
+DISPATCH_JOB_NAME = os.environ.get("DISPATCH_JOB_NAME")
+DISPATCH_WINDOW_SECONDS = float(os.environ.get("DISPATCH_WINDOW_SECONDS", "30"))
+DISPATCH_MAX_EVENTS = int(os.environ.get("DISPATCH_MAX_EVENTS", "200"))
+DISPATCH_GROUP_BY = os.environ.get("DISPATCH_GROUP_BY", "bucket")
+DISPATCH_OPERATIONS = [op.strip() for op in os.environ.get("DISPATCH_OPERATIONS", "Object:Write").split(',') if op.strip()]
+# A group whose job run cannot be created is retried after DISPATCH_RETRY_DELAY
+# seconds, doubling each time, and its keys are logged once DISPATCH_MAX_ATTEMPTS fail
+DISPATCH_MAX_ATTEMPTS = int(os.environ.get("DISPATCH_MAX_ATTEMPTS", "5"))
+DISPATCH_RETRY_DELAY = float(os.environ.get("DISPATCH_RETRY_DELAY", "5"))
+CE_PROJECT_ID = os.environ.get("CE_PROJECT_ID")
+
+# Prometheus metrics exposed on /metrics
+REQUEST_COUNT = Counter(
+    "cos_event_trigger_requests_total",
+    "HTTP requests handled, by endpoint and status code",
+    ["endpoint", "method", "status"]
+)
+REQUEST_LATENCY = Histogram(
+    "cos_event_trigger_request_duration_seconds",
+    "Time spent in the request handler, by endpoint",
+    ["endpoint"]
+)
+LOG_FORWARD_LATENCY = Histogram(
+    "cos_event_trigger_log_forward_duration_seconds",
+    "Time spent forwarding logs to IBM Cloud Logging, including the IAM token fetch"
+)
+LOG_FORWARD_FAILURES = Counter(
+    "cos_event_trigger_log_forward_failures_total",
+    "Requests to IBM Cloud Logging that failed",
+    ["reason"]
+)
+IAM_TOKEN_REFRESHES = Counter(
+    "cos_event_trigger_iam_token_refreshes_total",
+    "IAM access tokens requested from iam.cloud.ibm.com"
+)
+DUPLICATE_EVENTS = Counter(
+    "cos_event_trigger_duplicate_events_total",
+    "Redelivered events acknowledged without being counted or logged again"
+)
+QUEUE_DEPTH = Gauge(
+    "cos_event_trigger_queue_depth",
+    "Events received and still being processed"
+)
+DISPATCH_PENDING = Gauge(
+    "cos_event_trigger_dispatch_pending_events",
+    "Events waiting in the coalescing dispatcher for a job run"
+)
+JOB_RUNS_SUBMITTED = Counter(
+    "cos_event_trigger_job_runs_total",
+    "Code Engine job runs submitted by the dispatcher, by outcome",
+    ["status"]
+)
+JOB_RUN_SUBMIT_LATENCY = Histogram(
+    "cos_event_trigger_job_run_submit_duration_seconds",
+    "Time spent submitting a job run to the Code Engine API"
+)
+
+# Cached IAM token shared by the logging and Code Engine API calls
+iam_token_cache = {"token": None, "expiration": 0}
+iam_token_lock = threading.Lock()
+
 def get_iam_token():
-    ibmcloud_api_key = os.environ.get('IBMCLOUD_API_KEY')
-    if not ibmcloud_api_key:
-        raise ValueError("IBMCLOUD_API_KEY environment variable not found")
-    hdrs = { 'Accept': 'application/json', 'Content-Type' : 'application/x-www-form-urlencoded' }
-    params = { 'grant_type' : 'urn:ibm:params:oauth:grant-type:apikey',
-            'apikey': ibmcloud_api_key }
-    resp = httpx.post('https://iam.cloud.ibm.com/identity/token', data = params, headers = hdrs)
-    # raise exception if invalid status
-    resp.raise_for_status()
-    json_payload = resp.json()
-    token = json_payload['access_token']
-    return token
+    """Return a cached IAM token, fetching a new one a minute before the current one expires"""
+    with iam_token_lock:
+        if iam_token_cache["token"] and time.time() < iam_token_cache["expiration"] - 60:
+            return iam_token_cache["token"]
+
+        ibmcloud_api_key = os.environ.get('IBMCLOUD_API_KEY')
+        if not ibmcloud_api_key:
+            raise ValueError("IBMCLOUD_API_KEY environment variable not found")
+        hdrs = { 'Accept': 'application/json', 'Content-Type' : 'application/x-www-form-urlencoded' }
+        params = { 'grant_type' : 'urn:ibm:params:oauth:grant-type:apikey',
+                'apikey': ibmcloud_api_key }
+        resp = httpx.post('https://iam.cloud.ibm.com/identity/token', data = params, headers = hdrs)
+        IAM_TOKEN_REFRESHES.inc()
+        # raise exception if invalid status
+        resp.raise_for_status()
+        json_payload = resp.json()
+        iam_token_cache["token"] = json_payload['access_token']
+        iam_token_cache["expiration"] = json_payload.get('expiration', time.time() + json_payload.get('expires_in', 3600))
+        return iam_token_cache["token"]
 
 def send_to_ibm_logging(log_text, severity=None):
     """Send log to IBM Cloud Logging"""
+    return send_batch_to_ibm_logging([log_text], severity)
+
+def send_batch_to_ibm_logging(log_texts, severity=None):
+    """Send several logs to IBM Cloud Logging in a single request"""
     if not IBM_INSTANCE_ID:
         print("IBM Cloud Logging not configured. Set IBM_INSTANCE_ID and IBM_IAM_TOKEN environment variables.")
+        LOG_FORWARD_FAILURES.labels(reason="not_configured").inc()
         return False
-    
+
+    with LOG_FORWARD_LATENCY.time():
+        return _forward_logs(log_texts, severity)
+
+def _forward_logs(log_texts, severity):
     url = f"https://{IBM_INSTANCE_ID}.ingress.{CE_REGION}.logs.cloud.ibm.com/logs/v1/singles"
     
-    iam_token = get_iam_token()
+    try:
+        iam_token = get_iam_token()
+    except (ValueError, httpx.HTTPError) as e:
+        print(f"Error getting IAM token for IBM Cloud Logging: {str(e)}")
+        LOG_FORWARD_FAILURES.labels(reason="iam_token").inc()
+        return False
 
     headers = {
         "Content-Type": "application/json",
@@ -48,42 +156,478 @@ def send_to_ibm_logging(log_text, severity=None):
         "subsystemName": IBM_SUBSYSTEM_NAME,
         "severity": severity or IBM_LOG_SEVERITY,
         "text": log_text
-    }]
+    } for log_text in log_texts]
     
     try:
         response = httpx.post(url, headers=headers, json=payload, timeout=10.0)
         if response.status_code >= 200 and response.status_code < 300:
-            print(f"Successfully sent log to IBM Cloud Logging: {response.status_code}")
+            print(f"Successfully sent {len(payload)} log(s) to IBM Cloud Logging: {response.status_code}")
             return True
         else:
             print(f"Failed to send log to IBM Cloud Logging: {response.status_code}, {response.text}")
+            LOG_FORWARD_FAILURES.labels(reason="http_status").inc()
             return False
     except Exception as e:
         print(f"Error sending log to IBM Cloud Logging: {str(e)}")
+        LOG_FORWARD_FAILURES.labels(reason="error").inc()
         return False
 
+def empty_counts():
+    return {"by_bucket": {}, "by_type": {}, "by_object": {}}
+
+def add_counts(totals, counts):
+    """Add every by_bucket/by_type/by_object count from counts into totals"""
+    for name, items in totals.items():
+        for item, count in counts.get(name, {}).items():
+            items[item] = items.get(item, 0) + count
+
 # Equivalent to EventStats in Go
 class EventStats:
     def __init__(self):
         self.by_bucket = {}
         self.by_type = {}
         self.by_object = {}
-    
+        # Counts recorded by this instance that are not in the snapshot file yet
+        self.unsaved = empty_counts()
+        # Bumped on every change so the snapshot writer can skip idle periods
+        self.version = 0
+        self.lock = threading.Lock()
+
+    def _count(self, bucket, operation, key):
+        self.by_bucket[bucket] = self.by_bucket.get(bucket, 0) + 1
+        self.by_type[operation] = self.by_type.get(operation, 0) + 1
+        self.by_object[key] = self.by_object.get(key, 0) + 1
+        unsaved = self.unsaved
+        unsaved["by_bucket"][bucket] = unsaved["by_bucket"].get(bucket, 0) + 1
+        unsaved["by_type"][operation] = unsaved["by_type"].get(operation, 0) + 1
+        unsaved["by_object"][key] = unsaved["by_object"].get(key, 0) + 1
+
+    def record(self, bucket, operation, key):
+        with self.lock:
+            self._count(bucket, operation, key)
+            self.version += 1
+
+    def record_many(self, events):
+        """Count a list of (bucket, operation, key) tuples under a single lock acquisition"""
+        with self.lock:
+            for bucket, operation, key in events:
+                self._count(bucket, operation, key)
+            self.version += 1
+
+    def take_unsaved(self):
+        """Return the counts not written to the snapshot yet and start a new set"""
+        with self.lock:
+            unsaved, self.unsaved = self.unsaved, empty_counts()
+            return unsaved
+
+    def requeue(self, unsaved):
+        """Put counts from take_unsaved() back after a failed write"""
+        with self.lock:
+            add_counts(self.unsaved, unsaved)
+
+    def reset(self, snapshot):
+        """Show the snapshot totals plus the counts this instance has not written yet"""
+        with self.lock:
+            totals = empty_counts()
+            add_counts(totals, snapshot)
+            add_counts(totals, self.unsaved)
+            self.by_bucket, self.by_type, self.by_object = totals["by_bucket"], totals["by_type"], totals["by_object"]
+
     def to_dict(self):
-        return {
-            "by_bucket": self.by_bucket,
-            "by_type": self.by_type,
-            "by_object": self.by_object
-        }
+        with self.lock:
+            return {
+                "by_bucket": dict(self.by_bucket),
+                "by_type": dict(self.by_type),
+                "by_object": dict(self.by_object)
+            }
 
 # Global stats object
 stats = EventStats()
 
+class SeenEvents:
+    """Fixed-size LRU of event IDs used to drop at-least-once redeliveries"""
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.ids = OrderedDict()
+        self.lock = threading.Lock()
+
+    def check_and_add(self, event_id):
+        """Return True if event_id was already seen, otherwise remember it and return False"""
+        with self.lock:
+            if event_id in self.ids:
+                self.ids.move_to_end(event_id)
+                return True
+            self.ids[event_id] = None
+            if len(self.ids) > self.max_size:
+                self.ids.popitem(last=False)
+            return False
+
+seen_events = SeenEvents(DEDUP_CACHE_SIZE)
+
+def event_id(event, headers):
+    """Identify a delivery by its CloudEvents/notification ID, falling back to bucket, key, etag and operation"""
+    notification = event.get('notification') or {}
+    notification_id = headers.get('ce-id') or event.get('id') or notification.get('request_id')
+    if notification_id:
+        return notification_id
+    etag = event.get('etag') or notification.get('object_etag', '')
+    return (event.get('bucket'), event.get('key'), etag, event.get('operation'))
+
+def iter_batch_events(stream, chunk_size=64 * 1024):
+    """Yield (event, error) pairs from a JSON array or newline-delimited JSON body as it streams in.
+
+    A malformed NDJSON line only fails that item. A malformed JSON array
+    cannot be resynchronised, so it raises ValueError instead.
+    """
+    decoder = json.JSONDecoder()
+    utf8 = codecs.getincrementaldecoder("utf-8")()
+    buf = ""
+    mode = None
+    eof = False
+    # Array mode: an element must be followed by ',' or the closing ']'
+    after_element = False
+    first_element = True
+    while not eof or buf:
+        if not eof:
+            chunk = stream.read(chunk_size)
+            eof = not chunk
+            buf += utf8.decode(chunk, final=eof)
+        if mode is None:
+            buf = buf.lstrip()
+            if not buf:
+                continue
+            mode = "array" if buf[0] == "[" else "ndjson"
+            if mode == "array":
+                buf = buf[1:]
+
+        if mode == "ndjson":
+            *lines, buf = buf.split("\n")
+            if eof:
+                lines.append(buf)
+                buf = ""
+            for line in lines:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    yield json.loads(line), None
+                except ValueError as e:
+                    yield None, str(e)
+            continue
+
+        while True:
+            buf = buf.lstrip()
+            if not buf:
+                break
+            if after_element:
+                if buf[0] == "]":
+                    return
+                if buf[0] != ",":
+                    raise ValueError(f"Malformed JSON array: expected ',' or ']' at {buf[:20]!r}")
+                buf = buf[1:]
+                after_element = False
+                continue
+            if buf[0] == "]" and first_element:
+                return
+            try:
+                event, end = decoder.raw_decode(buf)
+            except ValueError as e:
+                if eof:
+                    raise ValueError(f"Malformed JSON array: {str(e)}") from e
+                # Element is split across chunks, read more
+                break
+            if not eof and not isinstance(event, (dict, list, str)) and (end == len(buf) or buf[end] in ".eE+-0123456789"):
+                # A number that reaches the end of the chunk, or stops where it could
+                # go on, may continue in the next one: 12 of 12345, 1 of 1.5
+                break
+            buf = buf[end:]
+            after_element = True
+            first_element = False
+            yield event, None
+        if eof:
+            raise ValueError("Malformed JSON array: missing closing ']'")
+
+def read_stats_snapshot():
+    """Return the parsed snapshot. Raises ValueError if it is corrupt and OSError if it cannot be read."""
+    try:
+        with gzip.open(STATS_SNAPSHOT_PATH, "rb") as f:
+            return json.loads(f.read())
+    except (EOFError, gzip.BadGzipFile) as e:
+        raise ValueError(f"Corrupt stats snapshot: {str(e)}") from e
+
+def save_stats_snapshot():
+    """Add this instance's unsaved counts to the snapshot file and replace it atomically.
+
+    The file is re-read before every write so instances scaled out on the same
+    volume add to each other's totals instead of overwriting them, and the live
+    stats are refreshed with what the other instances wrote. The read and the
+    replace are not locked: two instances writing in the same instant can still
+    lose one interval of counts.
+    """
+    unsaved = stats.take_unsaved()
+    try:
+        try:
+            snapshot = read_stats_snapshot()
+        except FileNotFoundError:
+            snapshot = {}
+        totals = empty_counts()
+        add_counts(totals, snapshot)
+        add_counts(totals, unsaved)
+        data = json.dumps(totals, separators=(",", ":")).encode("utf-8")
+        tmp_path = f"{STATS_SNAPSHOT_PATH}.{socket.gethostname()}.tmp"
+        with gzip.open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, STATS_SNAPSHOT_PATH)
+    except BaseException:
+        stats.requeue(unsaved)
+        raise
+    stats.reset(totals)
+
+def restore_stats_snapshot():
+    """Load the last snapshot into the live stats. Runs in the background so it never delays a request.
+
+    A read error is retried with backoff, since the volume may not be mounted
+    yet. A corrupt snapshot is moved aside for inspection and counting starts
+    from zero.
+    """
+    delay = 1
+    while True:
+        try:
+            snapshot = read_stats_snapshot()
+            break
+        except FileNotFoundError:
+            print(f"No stats snapshot found at {STATS_SNAPSHOT_PATH}, starting from zero")
+            return
+        except ValueError as e:
+            corrupt_path = f"{STATS_SNAPSHOT_PATH}.corrupt"
+            try:
+                os.replace(STATS_SNAPSHOT_PATH, corrupt_path)
+                print(f"Unable to restore stats snapshot from {STATS_SNAPSHOT_PATH}: {str(e)}. "
+                      f"Moved it to {corrupt_path} and starting from zero")
+                return
+            except OSError as move_error:
+                error = move_error
+        except OSError as e:
+            error = e
+        print(f"Unable to restore stats snapshot from {STATS_SNAPSHOT_PATH}: {str(error)}, retrying in {delay}s")
+        time.sleep(delay)
+        delay = min(delay * 2, 60)
+    stats.reset(snapshot)
+    print(f"Restored stats snapshot from {STATS_SNAPSHOT_PATH}")
+
+def snapshot_stats_periodically():
+    restore_stats_snapshot()
+    # None so events counted while the restore was retrying are written on the first pass
+    saved_version = None
+    while True:
+        time.sleep(STATS_SNAPSHOT_INTERVAL)
+        version = stats.version
+        if version == saved_version:
+            continue
+        try:
+            save_stats_snapshot()
+            # Only after a successful write, so counts put back by a failed one are retried
+            saved_version = version
+        except (OSError, ValueError) as e:
+            print(f"Unable to write stats snapshot to {STATS_SNAPSHOT_PATH}: {str(e)}")
+
+def save_final_stats_snapshot():
+    if not STATS_SNAPSHOT_PATH:
+        return
+    # Safe before the restore finished: the write only adds this instance's unsaved counts
+    try:
+        save_stats_snapshot()
+        print(f"Saved stats snapshot to {STATS_SNAPSHOT_PATH}")
+    except (OSError, ValueError) as e:
+        print(f"Unable to write stats snapshot to {STATS_SNAPSHOT_PATH}: {str(e)}")
+
+def start_stats_snapshots():
+    if not STATS_SNAPSHOT_PATH:
+        return
+    threading.Thread(target=snapshot_stats_periodically, name="stats-snapshot", daemon=True).start()
+
+class CodeEngineClient:
+    """Code Engine v2 REST API client reusing one pooled HTTP connection and the cached IAM token"""
+    def __init__(self, region, project_id):
+        self.http = httpx.Client(
+            base_url=f"https://api.{region}.codeengine.cloud.ibm.com/v2/projects/{project_id}",
+            timeout=30.0,
+            limits=httpx.Limits(max_connections=4, max_keepalive_connections=4)
+        )
+
+    def create_job_run(self, job_name, env_variables):
+        payload = {
+            "job_name": job_name,
+            "run_env_variables": [
+                {"type": "literal", "name": name, "value": value}
+                for name, value in env_variables.items()
+            ]
+        }
+        headers = {"Authorization": f"Bearer {get_iam_token()}"}
+        resp = self.http.post("/job_runs", headers=headers, json=payload)
+        resp.raise_for_status()
+        return resp.json()
+
+class JobDispatcher:
+    """Coalesce COS events into one Code Engine job run per bucket or key prefix"""
+    def __init__(self, client, job_name, window, max_events, group_by):
+        self.client = client
+        self.job_name = job_name
+        self.window = window
+        self.max_events = max_events
+        self.group_by = group_by
+        # group key -> {"bucket", "prefix", "keys", "opened"}
+        self.groups = {}
+        # Groups that reached max_events and are waiting for the worker
+        self.full = []
+        # (retry at, group) for groups whose job run could not be created yet
+        self.retries = []
+        self.cond = threading.Condition()
+
+    def group_key(self, bucket, key):
+        if self.group_by == "prefix":
+            return (bucket, key.rpartition('/')[0])
+        return (bucket, "")
+
+    def add(self, bucket, key):
+        group_key = self.group_key(bucket, key)
+        with self.cond:
+            group = self.groups.get(group_key)
+            if group is None:
+                group = {"bucket": bucket, "prefix": group_key[1], "keys": [], "opened": time.monotonic()}
+                self.groups[group_key] = group
+                # Wake the worker so it waits on this group's deadline
+                self.cond.notify()
+            group["keys"].append(key)
+            DISPATCH_PENDING.inc()
+            if len(group["keys"]) >= self.max_events:
+                self.full.append(self.groups.pop(group_key))
+                self.cond.notify()
+
+    def _pop_ready(self, flush_all=False):
+        now = time.monotonic()
+        expired = [
+            group_key for group_key, group in self.groups.items()
+            if flush_all or now - group["opened"] >= self.window
+        ]
+        ready = self.full + [self.groups.pop(group_key) for group_key in expired]
+        self.full = []
+        due = [group for retry_at, group in self.retries if flush_all or retry_at <= now]
+        self.retries = [(retry_at, group) for retry_at, group in self.retries if not flush_all and retry_at > now]
+        return ready + due
+
+    def _next_deadline(self):
+        deadlines = [group["opened"] + self.window for group in self.groups.values()]
+        deadlines.extend(retry_at for retry_at, _ in self.retries)
+        if not deadlines:
+            return None
+        return max(0, min(deadlines) - time.monotonic())
+
+    def submit(self, group, final=False):
+        """Create the job run for a group, scheduling a retry with backoff if that fails.
+
+        With final set, or after DISPATCH_MAX_ATTEMPTS failures, the group is
+        dropped and its keys are logged so they can be replayed.
+        """
+        keys = group["keys"]
+        env_variables = {
+            "COS_BUCKET": group["bucket"],
+            "COS_KEY_PREFIX": group["prefix"],
+            "COS_KEYS": json.dumps(keys, separators=(",", ":")),
+            "COS_KEY_COUNT": str(len(keys))
+        }
+        try:
+            with JOB_RUN_SUBMIT_LATENCY.time():
+                job_run = self.client.create_job_run(self.job_name, env_variables)
+            JOB_RUNS_SUBMITTED.labels(status="submitted").inc()
+            DISPATCH_PENDING.dec(len(keys))
+            print(f"Submitted job run {job_run.get('name')} for {len(keys)} objects in {group['bucket']}/{group['prefix']}")
+            return
+        except (ValueError, httpx.HTTPError) as e:
+            JOB_RUNS_SUBMITTED.labels(status="failed").inc()
+            error = str(e)
+        attempts = group["attempts"] = group.get("attempts", 0) + 1
+        if attempts < DISPATCH_MAX_ATTEMPTS and not final:
+            delay = DISPATCH_RETRY_DELAY * 2 ** (attempts - 1)
+            print(f"Failed to submit job run for {len(keys)} objects in {group['bucket']}/{group['prefix']} "
+                  f"(attempt {attempts} of {DISPATCH_MAX_ATTEMPTS}), retrying in {delay:g}s: {error}")
+            with self.cond:
+                self.retries.append((time.monotonic() + delay, group))
+                self.cond.notify()
+            return
+        JOB_RUNS_SUBMITTED.labels(status="dropped").inc()
+        DISPATCH_PENDING.dec(len(keys))
+        print(f"Dropped {len(keys)} objects in {group['bucket']}/{group['prefix']} after {attempts} failed "
+              f"job run submissions: {error}")
+        print("Dropped keys: " + json.dumps({"bucket": group["bucket"], "keys": keys}, separators=(",", ":")))
+
+    def run(self):
+        while True:
+            with self.cond:
+                ready = self._pop_ready()
+                if not ready:
+                    self.cond.wait(self._next_deadline())
+                    continue
+            for group in ready:
+                self.submit(group)
+
+    def flush(self):
+        with self.cond:
+            ready = self._pop_ready(flush_all=True)
+        for group in ready:
+            self.submit(group, final=True)
+
+dispatcher = None
+if DISPATCH_JOB_NAME:
+    # Without these every job run submission would fail and its events be lost
+    for name in ("CE_REGION", "CE_PROJECT_ID", "IBMCLOUD_API_KEY"):
+        if not os.environ.get(name):
+            raise ValueError(f"{name} environment variable not found, it is required when DISPATCH_JOB_NAME is set")
+    dispatcher = JobDispatcher(
+        CodeEngineClient(CE_REGION, CE_PROJECT_ID),
+        DISPATCH_JOB_NAME,
+        DISPATCH_WINDOW_SECONDS,
+        DISPATCH_MAX_EVENTS,
+        DISPATCH_GROUP_BY
+    )
+
+def dispatch_event(bucket, operation, key):
+    if dispatcher and operation in DISPATCH_OPERATIONS:
+        dispatcher.add(bucket, key)
+
+def start_job_dispatcher():
+    if not dispatcher:
+        return
+    threading.Thread(target=dispatcher.run, name="job-dispatcher", daemon=True).start()
+
+def handle_sigterm(signum, frame):
+    """Code Engine sends SIGTERM before scaling to zero; flush pending job runs and take a final snapshot"""
+    if dispatcher:
+        dispatcher.flush()
+    save_final_stats_snapshot()
+    sys.exit(0)
+
+@app.before_request
+def start_timer():
+    g.request_start = time.perf_counter()
+
+@app.after_request
+def record_request_metrics(response):
+    endpoint = request.url_rule.rule if request.url_rule else "unmatched"
+    REQUEST_COUNT.labels(endpoint, request.method, response.status_code).inc()
+    REQUEST_LATENCY.labels(endpoint).observe(time.perf_counter() - g.request_start)
+    return response
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    return generate_latest(), 200, {"Content-Type": CONTENT_TYPE_LATEST}
+
 @app.route('/stats', methods=['GET'])
 def get_stats():
     return jsonify(stats.to_dict())
 
 @app.route('/', methods=['POST'])
+@QUEUE_DEPTH.track_inprogress()
 def handle_event():
     current_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
     body = request.data.decode('utf-8')
@@ -91,14 +635,18 @@ def handle_event():
     # Parse the event data
     event = json.loads(body)
     
+    if seen_events.check_and_add(event_id(event, request.headers)):
+        DUPLICATE_EVENTS.inc()
+        print(f"{current_time} - Duplicate event ignored: {body}")
+        return "OK"
+
     # Update stats
     bucket = event.get('bucket', 'unknown')
     operation = event.get('operation', 'unknown')
     key = event.get('key', 'unknown')
     
-    stats.by_bucket[bucket] = stats.by_bucket.get(bucket, 0) + 1
-    stats.by_type[operation] = stats.by_type.get(operation, 0) + 1
-    stats.by_object[key] = stats.by_object.get(key, 0) + 1
+    stats.record(bucket, operation, key)
+    dispatch_event(bucket, operation, key)
     
     print(f"{current_time} - Received:")
     print(f"\nBody: {body}")
@@ -109,6 +657,75 @@ def handle_event():
     
     return "OK"
 
+@app.route('/batch', methods=['POST'])
+@QUEUE_DEPTH.track_inprogress()
+def handle_batch():
+    """Accept a JSON array or newline-delimited JSON of events and return a result per item.
+
+    Events are handled as they are parsed, so a body that turns out to be a
+    malformed JSON array still returns 400 with the results of the events
+    before the error; those were accepted and will be reported as duplicates
+    if sent again.
+    """
+    current_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    results = []
+    counted = []
+    log_messages = []
+    received = accepted = 0
+    logged = None
+
+    def flush():
+        nonlocal logged
+        stats.record_many(counted)
+        if log_messages:
+            sent = send_batch_to_ibm_logging(log_messages)
+            logged = sent if logged is None else logged and sent
+        counted.clear()
+        log_messages.clear()
+
+    parse_error = None
+    try:
+        for index, (event, error) in enumerate(iter_batch_events(request.stream)):
+            received += 1
+            if error is None and not isinstance(event, dict):
+                error = "Event must be a JSON object"
+            if error is not None:
+                results.append({"index": index, "status": "error", "error": error})
+                continue
+            if seen_events.check_and_add(event_id(event, {})):
+                DUPLICATE_EVENTS.inc()
+                results.append({"index": index, "status": "duplicate"})
+                continue
+
+            bucket = event.get('bucket', 'unknown')
+            operation = event.get('operation', 'unknown')
+            key = event.get('key', 'unknown')
+            accepted += 1
+            counted.append((bucket, operation, key))
+            dispatch_event(bucket, operation, key)
+            body = json.dumps(event, separators=(",", ":"))
+            log_messages.append(f"COS Event: {operation} on {bucket}/{key} - {body}")
+            results.append({"index": index, "status": "ok"})
+            if len(log_messages) >= BATCH_LOG_SIZE:
+                flush()
+    except ValueError as e:
+        parse_error = str(e)
+    flush()
+    print(f"{current_time} - Received batch of {received} events, {accepted} new")
+
+    response = {
+        "received": received,
+        "accepted": accepted,
+        "logged": bool(logged),
+        "results": results
+    }
+    if parse_error is not None:
+        return jsonify({"error": parse_error, **response}), 400
+    return jsonify(response)
+
 if __name__ == '__main__':
+    start_stats_snapshots()
+    start_job_dispatcher()
+    signal.signal(signal.SIGTERM, handle_sigterm)
     print("Listening on port 8080")
     app.run(host='0.0.0.0', port=8080)
\ No newline at end of file
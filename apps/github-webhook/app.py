@@ -3,6 +3,9 @@
 import os
 import hmac
 import hashlib
+import threading
+import time
+from collections import OrderedDict
 from flask import Flask, request, jsonify
 
 
@@ -10,6 +13,51 @@ app = Flask(__name__)
 # Fetch the GitHub secret from environment variables
 git_secret = os.environ.get("GIT_SECRET")
 
+
+class DeliveryCache:
+    """
+    Bounded, time-expiring set of processed X-GitHub-Delivery IDs.
+
+    Parameters:
+    - max_size: The maximum number of delivery IDs to remember.
+    - ttl: The number of seconds a delivery ID is remembered.
+    """
+    def __init__(self, max_size=1000, ttl=3600):
+        self.max_size = max_size
+        self.ttl = ttl
+        # delivery ID -> monotonic time it was recorded, oldest first
+        self.deliveries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def _expire(self, now):
+        while self.deliveries:
+            oldest = next(iter(self.deliveries.values()))
+            if now - oldest < self.ttl:
+                break
+            self.deliveries.popitem(last=False)
+
+    def seen(self, delivery_id):
+        """Return True if the delivery was already processed and has not expired."""
+        with self.lock:
+            self._expire(time.monotonic())
+            return delivery_id in self.deliveries
+
+    def add(self, delivery_id):
+        """Record the delivery as processed, evicting the oldest entry when full."""
+        with self.lock:
+            now = time.monotonic()
+            self._expire(now)
+            self.deliveries[delivery_id] = now
+            self.deliveries.move_to_end(delivery_id)
+            while len(self.deliveries) > self.max_size:
+                self.deliveries.popitem(last=False)
+
+
+processed_deliveries = DeliveryCache(
+    max_size=int(os.environ.get("DELIVERY_CACHE_SIZE", "1000")),
+    ttl=float(os.environ.get("DELIVERY_CACHE_TTL", "3600"))
+)
+
 def verify_event(req_headers, body, secret):
     """
     Verify the GitHub webhook event by checking its signature.
@@ -44,10 +92,18 @@ def webhook():
     Webhook endpoint that verifies GitHub webhook signatures.
     """
     try:
+        # Retries and redeliveries of a processed event skip the HMAC check
+        delivery_id = request.headers.get('X-GitHub-Delivery')
+        if delivery_id and processed_deliveries.seen(delivery_id):
+            return jsonify({'message': 'Duplicate delivery ignored', 'delivery': delivery_id})
+
         body = request.data
         headers = request.headers
         print(headers)
-        verify_event(request.headers, body, git_secret)
+        if not verify_event(request.headers, body, git_secret):
+            return jsonify({'error': 'Signature verification failed'}), 403
+        if delivery_id:
+            processed_deliveries.add(delivery_id)
         return jsonify({'message': 'Received and verified the event'})
     except Exception as e:
         return jsonify({'error': str(e)}), 400
@@ -0,0 +1,87 @@
+"""Pick the COS endpoint for a region, optionally by probing which one answers fastest"""
+import os
+import socket
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from urllib.parse import urlparse
+import ibm_boto3
+from ibm_botocore.client import Config
+
+PROBE_TIMEOUT = 1.0
+# Region and bucket can come from a request, so only the most recent lookups are kept
+ENDPOINT_CACHE_SIZE = 32
+# Storage class suffixes on a bucket's LocationConstraint, e.g. us-south-smart
+STORAGE_CLASSES = ("standard", "vault", "cold", "flex", "smart", "onerate_active")
+
+
+def endpoint_url(region, kind):
+    """Build the COS endpoint URL for a region. kind is direct, private or public."""
+    if kind == "public":
+        return f"https://s3.{region}.cloud-object-storage.appdomain.cloud"
+    return f"https://s3.{kind}.{region}.cloud-object-storage.appdomain.cloud"
+
+
+def probe_endpoint(url, timeout=PROBE_TIMEOUT):
+    """Return the seconds needed to open a TCP connection to the endpoint, or None if unreachable."""
+    host = urlparse(url).hostname
+    start = time.perf_counter()
+    try:
+        with socket.create_connection((host, 443), timeout=timeout):
+            return time.perf_counter() - start
+    except OSError:
+        return None
+
+
+def bucket_region(bucket):
+    """Look up the region a bucket lives in from the bound COS instance's extended bucket listing."""
+    cos = ibm_boto3.client("s3",
+        ibm_api_key_id=os.environ.get('CLOUD_OBJECT_STORAGE_APIKEY'),
+        ibm_service_instance_id=os.environ.get('CLOUD_OBJECT_STORAGE_RESOURCE_INSTANCE_ID'),
+        config=Config(signature_version="oauth"),
+        ibm_auth_endpoint="https://iam.cloud.ibm.com/identity/token",
+        endpoint_url=endpoint_url(os.environ.get('CE_REGION', 'us-south'), "public")
+    )
+    for found in cos.list_buckets_extended().get('Buckets', []):
+        if found['Name'] == bucket:
+            region, _, storage_class = found['LocationConstraint'].rpartition('-')
+            return region if storage_class in STORAGE_CLASSES else found['LocationConstraint']
+    return None
+
+
+@lru_cache(maxsize=ENDPOINT_CACHE_SIZE)
+def resolve_cos_endpoint(region=None, bucket=None, probe=None):
+    """Return the COS endpoint URL to use, caching the most recent ENDPOINT_CACHE_SIZE results.
+
+    Args:
+        region: COS region. Defaults to COS_REGION, then the bucket's location
+            when a bucket is given, then CE_REGION.
+        bucket: bucket whose location is looked up when no region is configured
+        probe: probe the direct, private and public endpoints concurrently and
+            pick the fastest reachable one. Defaults to COS_ENDPOINT_PROBE.
+            Without probing, the direct endpoint is used in Code Engine jobs
+            and the public endpoint elsewhere.
+    """
+    region = region or os.environ.get('COS_REGION')
+    if not region and bucket:
+        try:
+            region = bucket_region(bucket)
+        except Exception as e:
+            print(f"Unable to look up the location of bucket {bucket}: {e}")
+    region = region or os.environ.get('CE_REGION', 'us-south')
+
+    if probe is None:
+        probe = os.environ.get('COS_ENDPOINT_PROBE', '').lower() in ("1", "true", "yes")
+    if not probe:
+        return endpoint_url(region, "direct" if os.environ.get('CE_JOB', '') else "public")
+
+    candidates = [endpoint_url(region, kind) for kind in ("direct", "private", "public")]
+    with ThreadPoolExecutor(max_workers=len(candidates)) as executor:
+        latencies = dict(zip(candidates, executor.map(probe_endpoint, candidates)))
+    reachable = {url: seconds for url, seconds in latencies.items() if seconds is not None}
+    if not reachable:
+        print(f"No COS endpoint in {region} answered the probe, using the public endpoint")
+        return endpoint_url(region, "public")
+    fastest = min(reachable, key=reachable.get)
+    print(f"Selected COS endpoint {fastest} ({reachable[fastest] * 1000:.1f} ms)")
+    return fastest
@@ -0,0 +1,157 @@
+"""Streaming COS upload helper with optional gzip and concurrent multipart upload"""
+import io
+import os
+import time
+import zlib
+from ibm_boto3.s3.transfer import TransferConfig
+
+MULTIPART_THRESHOLD = 16 * 1024 * 1024
+PART_SIZE = 8 * 1024 * 1024
+MAX_CONCURRENCY = 8
+READ_SIZE = 1024 * 1024
+
+
+class IterStream(io.RawIOBase):
+    """Read-only file object over an iterable of bytes chunks."""
+
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        # memoryview so handing out part of a large chunk does not copy the rest
+        self.leftover = memoryview(b"")
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        # Fill the whole buffer unless the chunks run out: s3transfer decides between
+        # put_object and multipart upload from the size of a single read()
+        filled = 0
+        while filled < len(buffer):
+            if not self.leftover:
+                try:
+                    self.leftover = memoryview(next(self.chunks))
+                except StopIteration:
+                    break
+                continue
+            size = min(len(buffer) - filled, len(self.leftover))
+            buffer[filled:filled + size] = self.leftover[:size]
+            self.leftover = self.leftover[size:]
+            filled += size
+        return filled
+
+
+class CountingReader(io.RawIOBase):
+    """Wrap a file object and count the bytes read from it."""
+
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.bytes_read = 0
+
+    def readable(self):
+        return True
+
+    def read(self, size=-1):
+        data = self.fileobj.read(size)
+        if size is not None and size > 0:
+            # Keep reading until size bytes or EOF, file objects may return short reads
+            parts = [data]
+            remaining = size - len(data)
+            while data and remaining > 0:
+                data = self.fileobj.read(remaining)
+                parts.append(data)
+                remaining -= len(data)
+            data = b"".join(parts)
+        self.bytes_read += len(data)
+        return data
+
+    def readinto(self, buffer):
+        data = self.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+
+def iter_chunks(body):
+    """Yield bytes chunks from bytes, str, a file path, a file object or an iterable of bytes/str."""
+    if isinstance(body, str):
+        body = body.encode("utf-8")
+    if isinstance(body, (bytes, bytearray, memoryview)):
+        yield bytes(body)
+    elif isinstance(body, os.PathLike):
+        with open(body, "rb") as f:
+            yield from iter(lambda: f.read(READ_SIZE), b"")
+    elif hasattr(body, "read"):
+        yield from iter(lambda: body.read(READ_SIZE), b"")
+    else:
+        for chunk in body:
+            yield chunk.encode("utf-8") if isinstance(chunk, str) else chunk
+
+
+def gzip_chunks(chunks):
+    """Compress a stream of bytes chunks as gzip without buffering the whole body."""
+    compressor = zlib.compressobj(wbits=31)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+def upload_object(cos, bucket, key, body, compress=False, content_type=None,
+                  multipart_threshold=MULTIPART_THRESHOLD, part_size=PART_SIZE,
+                  max_concurrency=MAX_CONCURRENCY):
+    """Stream body to COS, switching to concurrent multipart upload above multipart_threshold.
+
+    Args:
+        cos: ibm_boto3 S3 client
+        bucket: target bucket
+        key: target object key
+        body: bytes, str, os.PathLike, file object, or iterable of bytes/str chunks
+        compress: gzip the body on the fly and set Content-Encoding: gzip
+        content_type: optional Content-Type for the object
+
+    Returns:
+        dict: key, bytes uploaded, seconds and MiB/s throughput
+    """
+    extra_args = {}
+    if compress:
+        extra_args["ContentEncoding"] = "gzip"
+    if content_type:
+        extra_args["ContentType"] = content_type
+    transfer_config = TransferConfig(
+        multipart_threshold=multipart_threshold,
+        multipart_chunksize=part_size,
+        max_concurrency=max_concurrency
+    )
+
+    if isinstance(body, (bytes, bytearray, memoryview, str)) and not compress:
+        body = io.BytesIO(body.encode("utf-8") if isinstance(body, str) else body)
+
+    start = time.perf_counter()
+    if isinstance(body, os.PathLike) and not compress:
+        # Real files go to upload_file, which reads parts concurrently by offset
+        bytes_uploaded = os.path.getsize(body)
+        cos.upload_file(os.fspath(body), bucket, key, ExtraArgs=extra_args or None, Config=transfer_config)
+    elif hasattr(body, "read") and not compress and body.seekable():
+        position = body.tell()
+        bytes_uploaded = body.seek(0, io.SEEK_END) - position
+        body.seek(position)
+        cos.upload_fileobj(body, bucket, key, ExtraArgs=extra_args or None, Config=transfer_config)
+    else:
+        # Streams are read one part at a time, so memory stays around part_size * max_concurrency
+        if hasattr(body, "read") and not compress:
+            reader = CountingReader(body)
+        else:
+            chunks = iter_chunks(body)
+            reader = CountingReader(IterStream(gzip_chunks(chunks) if compress else chunks))
+        cos.upload_fileobj(reader, bucket, key, ExtraArgs=extra_args or None, Config=transfer_config)
+        bytes_uploaded = reader.bytes_read
+    seconds = time.perf_counter() - start
+
+    result = {
+        "key": key,
+        "bytes": bytes_uploaded,
+        "seconds": round(seconds, 3),
+        "mib_per_second": round(bytes_uploaded / (1024 * 1024) / seconds, 2) if seconds else None
+    }
+    print(f"Uploaded {key}: {result['bytes']} bytes in {result['seconds']}s ({result['mib_per_second']} MiB/s)")
+    return result
@@ -0,0 +1,159 @@
+"""Cached VPC region catalog with optional per-region health tracking
+
+The catalog is kept in a local JSON file or, when REGION_CACHE_BUCKET is set,
+in a COS object so every job run can reuse it:
+
+    REGION_CACHE_PATH     local file, default /tmp/region-catalog.json
+    REGION_CACHE_BUCKET   COS bucket to keep the catalog in instead
+    REGION_CACHE_KEY      COS object key, default region-catalog.json
+    REGION_CACHE_TTL      seconds before the region list is fetched again, default 86400
+    REGION_HEALTH         true or false to turn health tracking on or off
+    REGION_COOLDOWN       seconds a failing region is skipped for, default 900
+
+The default /tmp file does not survive between Code Engine job runs, so health
+tracking, which skips regions that failed recently, is only on by default when
+REGION_CACHE_BUCKET or REGION_CACHE_PATH points at storage that does.
+"""
+import os
+import json
+import time
+import logging
+import threading
+
+REGION_CACHE_TTL = int(os.environ.get('REGION_CACHE_TTL', '86400'))
+REGION_COOLDOWN = int(os.environ.get('REGION_COOLDOWN', '900'))
+
+
+class FileStore:
+    def __init__(self, path):
+        self.path = path
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return None
+        with open(self.path, 'rt', encoding='utf-8') as f:
+            return json.load(f)
+
+    def save(self, catalog):
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'wt', encoding='utf-8') as f:
+            json.dump(catalog, f, separators=(",", ":"))
+        os.replace(tmp_path, self.path)
+
+
+class CosStore:
+    def __init__(self, bucket, key):
+        import ibm_boto3
+        from ibm_botocore.client import Config
+        self.bucket = bucket
+        self.key = key
+        region = os.environ.get('CE_REGION', 'us-south')
+        endpoint = f"s3.direct.{region}" if os.environ.get('CE_JOB', '') else f"s3.{region}"
+        self.cos = ibm_boto3.client("s3",
+            ibm_api_key_id=os.environ.get('CLOUD_OBJECT_STORAGE_APIKEY', os.environ.get('IBMCLOUD_API_KEY')),
+            ibm_service_instance_id=os.environ.get('CLOUD_OBJECT_STORAGE_RESOURCE_INSTANCE_ID'),
+            config=Config(signature_version="oauth"),
+            ibm_auth_endpoint="https://iam.cloud.ibm.com/identity/token",
+            endpoint_url=f"https://{endpoint}.cloud-object-storage.appdomain.cloud"
+        )
+
+    def load(self):
+        try:
+            return json.loads(self.cos.get_object(Bucket=self.bucket, Key=self.key)['Body'].read())
+        except self.cos.exceptions.NoSuchKey:
+            return None
+
+    def save(self, catalog):
+        self.cos.put_object(Bucket=self.bucket, Key=self.key, ContentType="application/json",
+                            Body=json.dumps(catalog, separators=(",", ":")).encode("utf-8"))
+
+
+def persistent_cache_configured():
+    return bool(os.environ.get('REGION_CACHE_BUCKET') or os.environ.get('REGION_CACHE_PATH'))
+
+
+def default_store():
+    bucket = os.environ.get('REGION_CACHE_BUCKET')
+    if bucket:
+        return CosStore(bucket, os.environ.get('REGION_CACHE_KEY', 'region-catalog.json'))
+    return FileStore(os.environ.get('REGION_CACHE_PATH', '/tmp/region-catalog.json'))
+
+
+class RegionCatalog:
+    """Region names fetched at most once per TTL, plus the health of each region.
+
+    Args:
+        fetch: callable returning the list of region names from the API
+        store: FileStore or CosStore; defaults from the environment
+        ttl: seconds the cached region list stays valid
+        track_health: skip regions that failed within the cooldown and
+            order the rest by their last measured latency. Defaults to
+            REGION_HEALTH, or on only when a persistent cache is configured.
+    """
+
+    def __init__(self, fetch, store=None, ttl=REGION_CACHE_TTL, track_health=None, cooldown=REGION_COOLDOWN):
+        self.fetch = fetch
+        self.store = store or default_store()
+        self.ttl = ttl
+        if track_health is None:
+            setting = os.environ.get('REGION_HEALTH')
+            if setting is None:
+                track_health = persistent_cache_configured()
+            else:
+                track_health = setting.lower() not in ("false", "0", "no")
+        self.track_health = track_health
+        self.cooldown = cooldown
+        self.lock = threading.Lock()
+        self.catalog = None
+
+    def load(self):
+        try:
+            self.catalog = self.store.load()
+        except Exception as e:
+            logging.warning("Unable to read region catalog: %s", e)
+        if not self.catalog:
+            self.catalog = {"fetched_at": 0, "regions": [], "health": {}}
+        if time.time() - self.catalog["fetched_at"] > self.ttl or not self.catalog["regions"]:
+            self.catalog["regions"] = self.fetch()
+            self.catalog["fetched_at"] = time.time()
+            self.save()
+        return self.catalog
+
+    def regions(self):
+        """Region names to work on: cooling-down regions dropped, fastest first."""
+        catalog = self.catalog or self.load()
+        if not self.track_health:
+            return list(catalog["regions"])
+        now = time.time()
+        health = catalog["health"]
+        healthy = []
+        for region in catalog["regions"]:
+            state = health.get(region, {})
+            if state.get("failures") and now - state.get("last_failure", 0) < self.cooldown:
+                retry_in = self.cooldown - (now - state["last_failure"])
+                logging.warning("Skipping region %s for another %ds after %d failures: %s",
+                                region, retry_in, state["failures"], state.get("error", "unknown error"))
+                continue
+            healthy.append(region)
+        return sorted(healthy, key=lambda region: health.get(region, {}).get("latency", 0))
+
+    def record(self, region, seconds=None, error=None):
+        """Record the latency of a successful call to a region, or a failure."""
+        if not self.track_health:
+            return
+        with self.lock:
+            state = self.catalog["health"].setdefault(region, {})
+            if error is None:
+                state["latency"] = round(seconds, 3)
+                state["failures"] = 0
+            else:
+                state["failures"] = state.get("failures", 0) + 1
+                state["last_failure"] = time.time()
+                state["error"] = str(error)[:200]
+
+    def save(self):
+        with self.lock:
+            try:
+                self.store.save(self.catalog)
+            except Exception as e:
+                logging.warning("Unable to write region catalog: %s", e)
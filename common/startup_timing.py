@@ -0,0 +1,51 @@
+"""Cold and warm start timing for Code Engine function entry points
+
+Import this module before anything else in the function's __main__.py, so the
+clock it starts covers the rest of the module's imports, and wrap the handler
+at the end of the module:
+
+    main = timed_entry_point(handle_request)
+"""
+import functools
+import json
+import threading
+import time
+
+# Module load of the entry point starts when it imports this module
+LOAD_START = time.perf_counter()
+
+
+def timed_entry_point(handler, log=print):
+    """Wrap a function handler so every invocation logs a startup_timing line.
+
+    The first invocation served by the instance is the cold start and also
+    reports how long the entry point module took to load, measured from the
+    import of this module until the handler is wrapped.
+
+    Args:
+        handler: callable taking the invocation params
+        log: callable given the line, e.g. print or logger.info
+    """
+    module_load_seconds = round(time.perf_counter() - LOAD_START, 4)
+    lock = threading.Lock()
+    invocations = 0
+
+    @functools.wraps(handler)
+    def main(params):
+        nonlocal invocations
+        start = time.perf_counter()
+        with lock:
+            invocations += 1
+            invocation_count = invocations
+        cold = invocation_count == 1
+        try:
+            return handler(params)
+        finally:
+            log("startup_timing " + json.dumps({
+                "invocation": "cold" if cold else "warm",
+                "module_load_seconds": module_load_seconds if cold else 0,
+                "invocation_seconds": round(time.perf_counter() - start, 4),
+                "invocation_count": invocation_count
+            }))
+
+    return main
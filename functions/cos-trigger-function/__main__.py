@@ -1,13 +1,72 @@
 #!/usr/bin/env python3
 
+# First import so the module load time it reports covers the imports below
+import startup_timing  # pylint: disable=wrong-import-order
 import os
 import json
 import logging
+import threading
 import ibm_boto3
+from collections import OrderedDict
 from datetime import datetime
 from ibm_botocore.client import Config, ClientError
+from cos_upload import upload_object
+from cos_endpoint import resolve_cos_endpoint
 
-def main(params):
+# Variable names containing any of these have their value replaced before export
+SECRET_MARKERS = ("APIKEY", "API_KEY", "SECRET", "TOKEN", "PASSWORD", "PASSWD", "CREDENTIAL", "PRIVATE_KEY")
+REDACTED = "***REDACTED***"
+# Redaction is a deployment setting so a caller cannot ask for the secret values
+REDACT_SECRETS = os.environ.get('REDACT_SECRETS', 'true').lower() not in ("false", "0", "no")
+
+# COS clients by endpoint, created on first use and reused by warm invocations. The
+# endpoint can come from the request, so only the most recently used ones are kept.
+COS_CLIENT_CACHE_SIZE = 8
+cos_clients = OrderedDict()
+cos_clients_lock = threading.Lock()
+
+def get_cos_client(cos_endpoint, cos_api_key, cos_instance_crn):
+    with cos_clients_lock:
+        if cos_endpoint in cos_clients:
+            cos_clients.move_to_end(cos_endpoint)
+            return cos_clients[cos_endpoint]
+        cos_clients[cos_endpoint] = ibm_boto3.client("s3",
+            ibm_api_key_id=cos_api_key,
+            ibm_service_instance_id=cos_instance_crn,
+            config=Config(signature_version="oauth"),
+            ibm_auth_endpoint="https://iam.cloud.ibm.com/identity/token",
+            endpoint_url=cos_endpoint
+        )
+        while len(cos_clients) > COS_CLIENT_CACHE_SIZE:
+            cos_clients.popitem(last=False)
+        return cos_clients[cos_endpoint]
+
+def parse_prefixes(value):
+    """Accept a list or a comma separated string of variable name prefixes."""
+    if not value:
+        return ()
+    if isinstance(value, str):
+        value = value.split(",")
+    return tuple(prefix.strip() for prefix in value if prefix.strip())
+
+def is_secret(name):
+    upper = name.upper()
+    return any(marker in upper for marker in SECRET_MARKERS)
+
+def iter_environment_json(prefixes=(), redact=True):
+    """Yield the selected environment variables as compact JSON, one entry per chunk."""
+    yield "{"
+    first = True
+    for key, value in os.environ.items():
+        if prefixes and not key.startswith(prefixes):
+            continue
+        if redact and is_secret(key):
+            value = REDACTED
+        yield ("" if first else ",") + json.dumps(key) + ":" + json.dumps(value)
+        first = False
+    yield "}"
+
+def export_environment(params):
     cos_instance_crn = os.environ.get('CLOUD_OBJECT_STORAGE_RESOURCE_INSTANCE_ID')
     if not cos_instance_crn:
         raise ValueError("CLOUD_OBJECT_STORAGE_RESOURCE_INSTANCE_ID environment variable not found. Make sure an Object storage instance is bound to this Code Engine project.")
@@ -16,37 +75,24 @@ def main(params):
     if not cos_api_key:
         raise ValueError("CLOUD_OBJECT_STORAGE_APIKEY environment variable not found. Make sure an Object storage instance is bound to this Code Engine project.")
 
-    cos_endpoint = params.get('cos_endpoint')
-    if not cos_endpoint:
-        raise ValueError("cos_endpoint parameter not found. Make sure to pass the cos_endpoint parameter in the request.")
-
     cos_bucket = params.get('cos_bucket')
     if not cos_bucket:
         raise ValueError("cos_bucket parameter not found. Make sure to pass the cos_bucket parameter in the request.")
 
-    # Check if 'CE_JOB' environment variable exists and is not empty, if so, use private endpoint
-    if os.environ.get('CE_JOB', ''):
-        cos_endpoint = f"https://s3.direct.{cos_endpoint}.cloud-object-storage.appdomain.cloud"
-    else:
-        cos_endpoint = f"https://s3.{cos_endpoint}.cloud-object-storage.appdomain.cloud"
+    # cos_endpoint is the COS region; when omitted it comes from COS_REGION, the bucket's location or CE_REGION
+    cos_endpoint = resolve_cos_endpoint(params.get('cos_endpoint'), cos_bucket)
 
     try:
-        cos = ibm_boto3.client("s3",
-            ibm_api_key_id=cos_api_key,
-            ibm_service_instance_id=cos_instance_crn,
-            config=Config(signature_version="oauth"),
-            ibm_auth_endpoint="https://iam.cloud.ibm.com/identity/token",
-            endpoint_url=cos_endpoint
-        )
+        cos = get_cos_client(cos_endpoint, cos_api_key, cos_instance_crn)
         
         current_datetime = datetime.now().strftime("%Y-%m-%d-%H-%M")
         item_name = f"{current_datetime}-env.json"
-        env_vars = {}
-        for key, value in os.environ.items():
-            env_vars[key] = value
-        
-        json_string = json.dumps(env_vars, indent=4)
-        cos.put_object(Body=json_string, Bucket=cos_bucket, Key=item_name)
+
+        # Only variables starting with one of the prefixes (e.g. CE_) are exported; all of them when none are given
+        prefixes = parse_prefixes(params.get('env_prefixes', os.environ.get('ENV_EXPORT_PREFIXES')))
+
+        result = upload_object(cos, cos_bucket, item_name, iter_environment_json(prefixes, REDACT_SECRETS),
+                               content_type="application/json")
         print("Item: {0} created!".format(item_name))
 
         return {
@@ -54,7 +100,7 @@ def main(params):
                 "Content-Type": "application/json",
             },
             "statusCode": 200,
-            "body": json.dumps(json_string)
+            "body": json.dumps({"key": item_name, "bytes": result["bytes"]})
         }
     except ClientError as be:
         return {
@@ -73,3 +119,5 @@ def main(params):
             "body": json.dumps({"error": "Server Error", "details": str(e)})
         }
 
+# Called by the Code Engine function runtime; logs cold and warm start timing per invocation
+main = startup_timing.timed_entry_point(export_environment)
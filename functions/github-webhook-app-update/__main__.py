@@ -1,26 +1,274 @@
 """main entry point to webhook function"""
+# First import so the module load time it reports covers the imports below
+import startup_timing  # pylint: disable=wrong-import-order
+import time
 import logging
 import os
 import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
 import httpx
-from helpers import verify_payload, verify_signature, get_iam_token
+from helpers import verify_payload, verify_signature, raw_body, get_header, DeliveryCache
+from ce_client import CodeEngineClient, IAMTokenCache, new_http_client, reset_timings, timings_summary
 
 HEADERS = {"Content-Type": "text/plain;charset=utf-8"}
 
+# When set, verified deliveries are acknowledged with 202 and deployed by a
+# background worker that only applies the newest head_sha per app. The worker
+# runs after the function has answered, see the README for what that means.
+ASYNC_DEPLOY = os.environ.get("ASYNC_DEPLOY", "").lower() in ("1", "true", "yes")
+
+# When set, each deploy polls the app until the new revision is ready (or
+# READY_TIMEOUT seconds pass) and logs the push-to-ready latency breakdown.
+WAIT_FOR_READY = os.environ.get("WAIT_FOR_READY", "").lower() in ("1", "true", "yes")
+READY_TIMEOUT = float(os.environ.get("READY_TIMEOUT", "300"))
+
+logging.basicConfig(level=os.environ.get("LOG_LEVEL", "INFO"))
 logger = logging.getLogger()
 
+# X-GitHub-Delivery IDs already handled by this instance, so retries and
+# redeliveries are acknowledged without a signature check or API calls
+processed_deliveries = DeliveryCache(
+    max_size=int(os.environ.get("DELIVERY_CACHE_SIZE", "1000")),
+    ttl=float(os.environ.get("DELIVERY_CACHE_TTL", "3600"))
+)
+
+# Optional mapping from repository and workflow to the apps it builds images
+# for, as a JSON list of rules. Without it, CE_APP in CE_PROJECT_ID/CE_REGION
+# is updated with DEFAULT_IMAGE_REPOSITORY.
+DEPLOY_TARGETS = json.loads(os.environ.get("DEPLOY_TARGETS", "[]"))
+DEFAULT_IMAGE_REPOSITORY = os.environ.get("IMAGE_REPOSITORY", "private.us.icr.io/rtiffany/dts-ce-py-app")
+MAX_PARALLEL_DEPLOYS = int(os.environ.get("MAX_PARALLEL_DEPLOYS", "8"))
+
+# (region, project_id, app) -> newest {"target", "workflow_run", "deliveries"} not yet deployed
+pending_deploys = {}
+# X-GitHub-Delivery ID -> app keys still to deploy before the delivery counts as processed
+outstanding_deliveries = {}
+# (region, project_id, app) -> updated_at of the newest workflow run accepted, to drop stale deliveries
+latest_accepted = {}
+pending_cond = threading.Condition()
+deploy_worker = None
+
+# Created on first use and kept for later warm invocations so the HTTP/2
+# connection pool and IAM token are reused, one client per project
+http_client = None
+iam_tokens = None
+ce_clients = {}
+deploy_executor = None
+ce_client_lock = threading.Lock()
+
+
+def get_ce_client(ibmcloud_api_key, region, project_id):
+    global http_client, iam_tokens
+    with ce_client_lock:
+        if http_client is None:
+            http_client = new_http_client()
+            iam_tokens = IAMTokenCache(ibmcloud_api_key, http_client)
+        key = (region, project_id)
+        if key not in ce_clients:
+            ce_clients[key] = CodeEngineClient(iam_tokens, http_client, region, project_id)
+        return ce_clients[key]
+
+
+def get_deploy_executor():
+    global deploy_executor
+    with ce_client_lock:
+        if deploy_executor is None:
+            deploy_executor = ThreadPoolExecutor(max_workers=MAX_PARALLEL_DEPLOYS)
+        return deploy_executor
+
+
+def workflow_matches(rule_workflow, workflow_run):
+    """Match a rule's workflow against the run's workflow name, file name or path. Missing or * matches all."""
+    if not rule_workflow or rule_workflow == "*":
+        return True
+    path = workflow_run.get('path') or ""
+    return rule_workflow in (workflow_run.get('name'), path, path.rsplit('/', 1)[-1])
+
+
+def resolve_targets(payload_body):
+    """Return the apps to update for this delivery as dicts with app, region, project_id and image."""
+    if not DEPLOY_TARGETS:
+        return [{
+            "app": os.environ.get('CE_APP'),
+            "region": os.environ.get('CE_REGION'),
+            "project_id": os.environ.get('CE_PROJECT_ID'),
+            "image": DEFAULT_IMAGE_REPOSITORY
+        }]
+
+    repository = payload_body.get('repository', {}).get('full_name')
+    workflow_run = payload_body['workflow_run']
+    targets = []
+    for rule in DEPLOY_TARGETS:
+        if rule.get('repository') not in (None, "*", repository):
+            continue
+        if not workflow_matches(rule.get('workflow'), workflow_run):
+            continue
+        for target in rule.get('apps', []):
+            targets.append({
+                "app": target['app'],
+                "region": target.get('region', os.environ.get('CE_REGION')),
+                "project_id": target.get('project_id', os.environ.get('CE_PROJECT_ID')),
+                "image": target.get('image', DEFAULT_IMAGE_REPOSITORY)
+            })
+    return targets
+
+
+def seconds_since(timestamp):
+    """Seconds between a GitHub ISO 8601 timestamp and now, or None if it is missing."""
+    if not timestamp:
+        return None
+    started = datetime.fromisoformat(timestamp.replace("Z", "+00:00"))
+    return round((datetime.now(timezone.utc) - started).total_seconds(), 1)
+
+
+def deploy_image(ibmcloud_api_key, target, workflow_run):
+    """PATCH the target app's image_reference to the image built for the workflow run's head_sha.
+
+    With WAIT_FOR_READY, also waits for the new revision to become ready.
+    Returns a dict with the revision, rollout status and timing breakdown.
+    Raises httpx.HTTPError on API failures.
+    """
+    reset_timings()
+    client = get_ce_client(ibmcloud_api_key, target['region'], target['project_id'])
+    short_tag = workflow_run['head_sha'][:8]
+    app_patch_model = { "image_reference": f"{target['image']}:{short_tag}" }
+    previous = {}
+    app_json_payload = client.update_app(target['app'], app_patch_model, previous=previous)
+    result = {
+        "app": target['app'],
+        "project_id": target['project_id'],
+        "region": target['region'],
+        "head_sha": workflow_run['head_sha'],
+        "latest_ready_revision": app_json_payload.get('latest_ready_revision', None),
+        "rollout": "skipped"
+    }
+    if WAIT_FOR_READY:
+        result["rollout"], app = client.wait_for_ready(
+            target['app'], previous.get('latest_created_revision'), timeout=READY_TIMEOUT)
+        result["latest_ready_revision"] = app.get('latest_ready_revision', result["latest_ready_revision"])
+        if result["rollout"] == "ready":
+            result["push_to_ready_seconds"] = seconds_since(workflow_run.get('created_at'))
+    result["timings"] = timings_summary()
+    logger.info("deploy_latency %s", json.dumps(result))
+    return result
+
+
+def deploy_one(ibmcloud_api_key, target, workflow_run):
+    """deploy_image() that reports an API failure in the result instead of raising."""
+    try:
+        return deploy_image(ibmcloud_api_key, target, workflow_run)
+    except httpx.HTTPError as e:
+        logger.error("Failed to update %s to %s: %s", target['app'], workflow_run['head_sha'][:8], e)
+        return {"app": target['app'], "project_id": target['project_id'], "region": target['region'],
+                "head_sha": workflow_run['head_sha'], "error": str(e)}
+
+
+def deploy_all(ibmcloud_api_key, deploys):
+    """Update every (target, workflow_run) pair concurrently.
+
+    Returns the per-app results and the wall-clock seconds, which is close to
+    the slowest app rather than the sum.
+    """
+    start = time.perf_counter()
+    if len(deploys) == 1:
+        results = [deploy_one(ibmcloud_api_key, *deploys[0])]
+    else:
+        executor = get_deploy_executor()
+        results = list(executor.map(lambda deploy: deploy_one(ibmcloud_api_key, *deploy), deploys))
+    return results, round(time.perf_counter() - start, 4)
+
+
+def finish_delivery(delivery_id, key, ok):
+    """Mark one app of a queued delivery as done; call with pending_cond held.
+
+    The delivery is only recorded as processed once all its apps deployed, so a
+    GitHub redelivery after a failed or lost background deploy is retried.
+    """
+    keys = outstanding_deliveries.get(delivery_id)
+    if keys is None:
+        return
+    if not ok:
+        del outstanding_deliveries[delivery_id]
+        return
+    keys.discard(key)
+    if not keys:
+        del outstanding_deliveries[delivery_id]
+        processed_deliveries.add(delivery_id)
 
-def main(params):
+
+def deploy_worker_loop(ibmcloud_api_key):
+    """Deploy the newest pending head_sha for every app that has one, all apps concurrently"""
+    while True:
+        with pending_cond:
+            while not pending_deploys:
+                pending_cond.wait()
+            batch = list(pending_deploys.items())
+            pending_deploys.clear()
+        results, total_seconds = deploy_all(
+            ibmcloud_api_key, [(pending["target"], pending["workflow_run"]) for _, pending in batch])
+        with pending_cond:
+            for (key, pending), result in zip(batch, results):
+                for delivery_id in pending["deliveries"]:
+                    finish_delivery(delivery_id, key, "error" not in result)
+        for result in results:
+            if "error" not in result:
+                logger.info("Updated %s to %s, latest ready revision %s", result['app'],
+                            result['head_sha'][:8], result['latest_ready_revision'])
+        logger.info("Deployed %d app(s) in %ss", len(results), total_seconds)
+
+
+def enqueue_deploy(ibmcloud_api_key, target, workflow_run, delivery_id=None):
+    """Record the workflow run for a background deploy of target, replacing any older pending one.
+
+    The replaced run's deliveries are carried over, since deploying the newer
+    head_sha completes them too. Returns False if a newer run for the same app
+    was already accepted.
+    """
+    global deploy_worker
+    key = (target['region'], target['project_id'], target['app'])
+    updated_at = workflow_run.get('updated_at') or ""
+    with pending_cond:
+        if updated_at < latest_accepted.get(key, ""):
+            if delivery_id:
+                finish_delivery(delivery_id, key, True)
+            return False
+        latest_accepted[key] = updated_at
+        deliveries = pending_deploys.get(key, {}).get("deliveries", [])
+        pending_deploys[key] = {
+            "target": target,
+            "workflow_run": {
+                "head_sha": workflow_run['head_sha'],
+                "created_at": workflow_run.get('created_at'),
+                "updated_at": updated_at
+            },
+            "deliveries": deliveries + [delivery_id] if delivery_id else deliveries
+        }
+        if deploy_worker is None or not deploy_worker.is_alive():
+            deploy_worker = threading.Thread(target=deploy_worker_loop, args=(ibmcloud_api_key,), daemon=True)
+            deploy_worker.start()
+        pending_cond.notify()
+    return True
+
+
+def handle_delivery(params):
     ibmcloud_api_key = os.environ.get('IBMCLOUD_API_KEY')
     if not ibmcloud_api_key:
         raise ValueError("IBMCLOUD_API_KEY environment variable not found")
 
+    # Without a secret, deliveries are accepted unsigned and no raw body is needed
     secret_token = os.environ.get("WEBHOOK_SECRET")
-    if not secret_token:
-        raise ValueError("WEBHOOK_SECRET environment variable not found")
 
     payload_body = params
     headers = payload_body["__ce_headers"]
+    delivery_id = get_header(headers, "X-GitHub-Delivery")
+    if delivery_id and processed_deliveries.seen(delivery_id):
+        return {
+            "headers": {"Content-Type": "application/json"},
+            "statusCode": 200,
+            "body": json.dumps({"delivery": delivery_id, "status": "duplicate"})
+        }
     signature_header = headers.get("X-Hub-Signature-256", None)
     image_tag = payload_body.get('workflow_run', {}).get('head_sha', None)
     if not image_tag:
@@ -29,52 +277,89 @@ def main(params):
             "statusCode": 400,
             "body": "Missing image tag"
         }
-    verify_payload(payload_body)
-    verify_signature(payload_body, secret_token, signature_header)
-
-    iam_token = get_iam_token(ibmcloud_api_key)
-    if not iam_token:
-        return {
-            "headers": HEADERS,
-            "statusCode": 500,
-            "body": "Failed to get IAM token",
-        }
+    invalid_payload = verify_payload(payload_body, require_signature=bool(secret_token))
+    if invalid_payload:
+        return {"statusCode": 400, **invalid_payload}
 
-    code_engine_app = os.environ.get('CE_APP')
-    code_engine_region = os.environ.get('CE_REGION')
-    project_id = os.environ.get('CE_PROJECT_ID')
-    app_endpoint = f"https://api.{code_engine_region}.codeengine.cloud.ibm.com/v2/projects/{project_id}/apps/{code_engine_app}"
+    signature_seconds = 0
+    if secret_token:
+        body_bytes = raw_body(payload_body)
+        if body_bytes is None:
+            return {
+                "headers": HEADERS,
+                "statusCode": 400,
+                "body": "Missing raw request body"
+            }
+        signature_start = time.perf_counter()
+        invalid_signature = verify_signature(body_bytes, secret_token, signature_header)
+        signature_seconds = round(time.perf_counter() - signature_start, 4)
+        if invalid_signature:
+            return invalid_signature
+    else:
+        logger.warning("WEBHOOK_SECRET is not set, accepting the delivery without a signature check")
 
-    try:
-
-        app_get = httpx.get(app_endpoint, headers = { "Authorization" : iam_token })
-        results = app_get.json()
-        etag = results['entity_tag']
-        short_tag = image_tag[:8]
-        update_headers = { "Authorization" : iam_token, "Content-Type" : "application/merge-patch+json", "If-Match" : etag }
-        app_patch_model = { "image_reference": "private.us.icr.io/rtiffany/dts-ce-py-app:" + short_tag }
-        app_update = httpx.patch(app_endpoint, headers = update_headers, json = app_patch_model)
-        app_update.raise_for_status()
-        app_json_payload = app_update.json()
-        latest_ready_revision = app_json_payload.get('latest_ready_revision', None)
-
-        data = {
+    workflow_run = payload_body['workflow_run']
+    targets = resolve_targets(payload_body)
+    if not targets:
+        if delivery_id:
+            processed_deliveries.add(delivery_id)
+        return {
             "headers": {"Content-Type": "application/json"},
             "statusCode": 200,
-            "latest_ready_revision": latest_ready_revision,
-            "body": "App updated successfully"
+            "body": json.dumps({"head_sha": image_tag, "status": "no matching deploy targets"})
         }
- 
-        return {
-                "headers": {"Content-Type": "application/json"},
-                "statusCode": 200,
-                "body": json.dumps(data)
+
+    if ASYNC_DEPLOY:
+        if delivery_id:
+            with pending_cond:
+                if delivery_id in outstanding_deliveries:
+                    return {
+                        "headers": {"Content-Type": "application/json"},
+                        "statusCode": 202,
+                        "body": json.dumps({"delivery": delivery_id, "status": "in progress"})
+                    }
+                outstanding_deliveries[delivery_id] = {
+                    (target['region'], target['project_id'], target['app']) for target in targets
                 }
-    except httpx.HTTPError as e:
-        # Define results here to avoid the error
-        results = {"error": str(e)}
+        queued = [
+            {
+                "app": target['app'],
+                "project_id": target['project_id'],
+                "status": "queued" if enqueue_deploy(ibmcloud_api_key, target, workflow_run, delivery_id) else "superseded"
+            }
+            for target in targets
+        ]
         return {
-                "headers": {"Content-Type": "application/json"},
-                "statusCode": 500,
-                "body": json.dumps(results)
-        }
\ No newline at end of file
+            "headers": {"Content-Type": "application/json"},
+            "statusCode": 202,
+            "body": json.dumps({"head_sha": image_tag, "apps": queued})
+        }
+
+    results, total_seconds = deploy_all(ibmcloud_api_key, [(target, workflow_run) for target in targets])
+    failed = [result for result in results if "error" in result]
+    if not failed and delivery_id:
+        processed_deliveries.add(delivery_id)
+
+    if not failed:
+        status_code, message = 200, "App updated successfully" if len(results) == 1 else "Apps updated successfully"
+    elif len(failed) < len(results):
+        status_code, message = 207, f"{len(failed)} of {len(results)} app updates failed"
+    else:
+        status_code, message = 500, "App update failed" if len(results) == 1 else "All app updates failed"
+
+    data = {
+        "headers": {"Content-Type": "application/json"},
+        "statusCode": status_code,
+        "results": results,
+        "timings": {"signature": signature_seconds, "total_deploy": total_seconds},
+        "body": message
+    }
+    return {
+            "headers": {"Content-Type": "application/json"},
+            "statusCode": status_code,
+            "body": json.dumps(data)
+            }
+
+
+# Called by the Code Engine function runtime; logs cold and warm start timing per invocation
+main = startup_timing.timed_entry_point(handle_delivery, log=logger.info)
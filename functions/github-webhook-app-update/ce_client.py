@@ -0,0 +1,147 @@
+"""Code Engine v2 API client reused across warm function invocations"""
+import logging
+import threading
+import time
+from contextlib import contextmanager
+import httpx
+
+IAM_TOKEN_URL = "https://iam.cloud.ibm.com/identity/token"
+
+logger = logging.getLogger()
+
+# Per-thread list of (call name, seconds) since the last reset_timings(), so
+# concurrent deploys each get their own breakdown
+_local = threading.local()
+
+
+def current_timings():
+    if not hasattr(_local, "timings"):
+        _local.timings = []
+    return _local.timings
+
+
+def reset_timings():
+    _local.timings = []
+
+
+def timings_summary():
+    """Total seconds per call name since the last reset_timings()."""
+    summary = {}
+    for name, seconds in current_timings():
+        summary[name] = round(summary.get(name, 0) + seconds, 4)
+    return summary
+
+
+@contextmanager
+def timed(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        current_timings().append((name, round(time.perf_counter() - start, 4)))
+
+
+def new_http_client():
+    """HTTP/2 client whose connection pool is shared by every CodeEngineClient."""
+    return httpx.Client(http2=True, timeout=30.0)
+
+
+class IAMTokenCache:
+    """IAM access token cached until a minute before it expires.
+
+    Args:
+        ibmcloud_api_key: API key used to request IAM tokens
+        http: httpx.Client used for the token request
+    """
+
+    def __init__(self, ibmcloud_api_key, http):
+        self.ibmcloud_api_key = ibmcloud_api_key
+        self.http = http
+        self.iam_token = None
+        self.iam_token_expiration = 0
+        self.lock = threading.Lock()
+
+    def token(self):
+        with self.lock:
+            if self.iam_token and time.time() < self.iam_token_expiration - 60:
+                return self.iam_token
+            hdrs = { "Accept" : "application/json", "Content-Type" : "application/x-www-form-urlencoded" }
+            iam_params = { "grant_type" : "urn:ibm:params:oauth:grant-type:apikey", "apikey" : self.ibmcloud_api_key }
+            with timed("iam_token"):
+                resp = self.http.post(IAM_TOKEN_URL, data = iam_params, headers = hdrs)
+            resp.raise_for_status()
+            token_data = resp.json()
+            self.iam_token = token_data['access_token']
+            self.iam_token_expiration = token_data.get('expiration', time.time() + token_data.get('expires_in', 3600))
+            return self.iam_token
+
+
+class CodeEngineClient:
+    """Code Engine v2 API client for one project.
+
+    Args:
+        iam_tokens: IAMTokenCache shared between clients
+        http: httpx.Client shared between clients
+        region: Code Engine region, e.g. us-south
+        project_id: Code Engine project ID
+        max_retries: how many times to re-read the etag and retry a PATCH after a 412
+    """
+
+    def __init__(self, iam_tokens, http, region, project_id, max_retries=3):
+        self.iam_tokens = iam_tokens
+        self.http = http
+        self.base_url = f"https://api.{region}.codeengine.cloud.ibm.com/v2/projects/{project_id}"
+        self.max_retries = max_retries
+
+    def request(self, name, method, path, headers=None, **kwargs):
+        all_headers = { "Authorization" : f"Bearer {self.iam_tokens.token()}" }
+        all_headers.update(headers or {})
+        with timed(name):
+            return self.http.request(method, f"{self.base_url}{path}", headers = all_headers, **kwargs)
+
+    def get_app(self, app_name, call_name="get_app"):
+        resp = self.request(call_name, "GET", f"/apps/{app_name}")
+        resp.raise_for_status()
+        return resp.json()
+
+    def update_app(self, app_name, app_patch_model, previous=None):
+        """PATCH the app, re-reading the etag and retrying if another update got there first (412).
+
+        If previous is a dict, it is filled with the app as read right before the successful PATCH.
+        """
+        for attempt in range(self.max_retries + 1):
+            app = self.get_app(app_name)
+            if previous is not None:
+                previous.clear()
+                previous.update(app)
+            etag = app['entity_tag']
+            update_headers = { "Content-Type" : "application/merge-patch+json", "If-Match" : etag }
+            resp = self.request("update_app", "PATCH", f"/apps/{app_name}", headers = update_headers, json = app_patch_model)
+            if resp.status_code == 412 and attempt < self.max_retries:
+                logger.warning("Etag for %s changed during update, retrying (%d/%d)", app_name, attempt + 1, self.max_retries)
+                continue
+            resp.raise_for_status()
+            return resp.json()
+        return None
+
+    def wait_for_ready(self, app_name, previous_revision, timeout=300, initial_delay=1.0, max_delay=15.0):
+        """Poll the app with exponential backoff until a revision newer than previous_revision is ready.
+
+        Returns a tuple of (status, app) where status is "ready", "failed" or "timeout".
+        """
+        deadline = time.monotonic() + timeout
+        delay = initial_delay
+        app = {}
+        with timed("rollout"):
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return "timeout", app
+                time.sleep(min(delay, remaining))
+                app = self.get_app(app_name, call_name="rollout_poll")
+                created = app.get('latest_created_revision')
+                if app.get('status') == "failed":
+                    return "failed", app
+                if created and created != previous_revision and app.get('latest_ready_revision') == created:
+                    return "ready", app
+                delay = min(delay * 2, max_delay)
@@ -1,16 +1,62 @@
-import json
+import base64
+import binascii
 import hashlib
 import hmac
-import httpx
+import threading
+import time
+from collections import OrderedDict
 
 HEADERS = {"Content-Type": "text/plain;charset=utf-8"}
+# The function runtime passes bodies of these content types (and text/*, *+json)
+# in __ce_body as text, and every other body base64 encoded
+TEXT_CONTENT_TYPES = ("application/json", "application/x-www-form-urlencoded")
 
 
-def verify_payload(params):
-    """Verify X-Hub-Signature-256, commits, & head_commit.id exist."""
-    if (
-        "__ce_headers" not in params
-        or "X-Hub-Signature-256" not in params["__ce_headers"]
+class DeliveryCache:
+    """Bounded, time-expiring set of processed X-GitHub-Delivery IDs."""
+
+    def __init__(self, max_size=1000, ttl=3600):
+        self.max_size = max_size
+        self.ttl = ttl
+        # delivery ID -> monotonic time it was recorded, oldest first
+        self.deliveries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def _expire(self, now):
+        while self.deliveries:
+            oldest = next(iter(self.deliveries.values()))
+            if now - oldest < self.ttl:
+                break
+            self.deliveries.popitem(last=False)
+
+    def seen(self, delivery_id):
+        """Return True if delivery_id was already processed and has not expired."""
+        with self.lock:
+            self._expire(time.monotonic())
+            return delivery_id in self.deliveries
+
+    def add(self, delivery_id):
+        """Record delivery_id as processed, evicting the oldest entry when full."""
+        with self.lock:
+            now = time.monotonic()
+            self._expire(now)
+            self.deliveries[delivery_id] = now
+            self.deliveries.move_to_end(delivery_id)
+            while len(self.deliveries) > self.max_size:
+                self.deliveries.popitem(last=False)
+
+def get_header(headers, name):
+    """Case-insensitive header lookup, the runtime may canonicalise header names."""
+    name = name.lower()
+    for key, value in headers.items():
+        if key.lower() == name:
+            return value
+    return None
+
+def verify_payload(params, require_signature=True):
+    """Verify X-Hub-Signature-256 (when require_signature is set) and workflow_run exist."""
+    if "__ce_headers" not in params or (
+        require_signature and "X-Hub-Signature-256" not in params["__ce_headers"]
     ):
         return {
             "headers": HEADERS,
@@ -25,26 +71,42 @@ def verify_payload(params):
 
     return None
 
+def raw_body(params):
+    """Return the request body exactly as delivered by the Code Engine function runtime.
+
+    The runtime passes the raw body in __ce_body as plain text for text
+    content types and base64 encoded otherwise, so the request's
+    Content-Type decides how it is read. Returns None if the runtime did
+    not include it or a binary body is not valid base64.
+    """
+    body = params.get("__ce_body")
+    if body is None:
+        return None
+    if isinstance(body, bytes):
+        return body
+    content_type = get_header(params.get("__ce_headers", {}), "Content-Type") or ""
+    content_type = content_type.split(";")[0].strip().lower()
+    if content_type.startswith("text/") or content_type.endswith("+json") or content_type in TEXT_CONTENT_TYPES:
+        return body.encode('utf-8')
+    try:
+        return base64.b64decode(body, validate=True)
+    except (binascii.Error, ValueError):
+        return None
+
 def verify_signature(payload_body, secret_token, signature_header):
     """Verify that the payload was sent from GitHub by validating SHA256.
 
-    Raise and return 403 if not authorized.
+    Return a 403 response if not authorized.
 
     Args:
-        payload_body: original request body to verify (request.body())
+        payload_body: raw request body bytes, exactly as GitHub signed them
         secret_token: GitHub app webhook token (WEBHOOK_SECRET)
         signature_header: header received from GitHub (x-hub-signature-256)
     """
-    for value in payload_body:
-        value: str
-        if value.startswith("__"):
-            del value
-    payload_body_bytes = json.dumps(payload_body).encode('utf-8')
-
-    hash_object = hmac.new(secret_token.encode('utf-8'), msg=payload_body_bytes, digestmod=hashlib.sha256)
+    hash_object = hmac.new(secret_token.encode('utf-8'), msg=payload_body, digestmod=hashlib.sha256)
     expected_signature = "sha256=" + hash_object.hexdigest()
 
-    if not hmac.compare_digest(expected_signature, signature_header):
+    if not signature_header or not hmac.compare_digest(expected_signature, signature_header):
         return {
             "statusCode": 403,
             "headers": HEADERS,
@@ -52,12 +114,3 @@ def verify_signature(payload_body, secret_token, signature_header):
         }
 
     return None
-
-def get_iam_token(ibmcloud_api_key):
-    """Get IAM token from IBM Cloud using API key."""
-    hdrs = { "Accept" : "application/json", "Content-Type" : "application/x-www-form-urlencoded" }
-    iam_params = { "grant_type" : "urn:ibm:params:oauth:grant-type:apikey", "apikey" : ibmcloud_api_key }
-    resp = httpx.post('https://iam.cloud.ibm.com/identity/token', data = iam_params, headers = hdrs)
-    resp.raise_for_status() 
-    return resp.json().get('access_token', None)
-
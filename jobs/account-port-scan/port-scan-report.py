@@ -18,6 +18,7 @@ import sys
 import os
 import socket
 import json
+import time
 import logging
 import logging.config
 import requests
@@ -25,6 +26,7 @@ import SoftLayer
 import ibm_vpc
 from ibm_cloud_sdk_core import ApiException
 from ibm_cloud_sdk_core.authenticators import IAMAuthenticator
+from region_catalog import RegionCatalog
 
 """
 Pull IBM Cloud API key from environment. If not set, raise an error. 
@@ -73,9 +75,9 @@ def sl_iam_client():
     return client
 
 
-def get_regions():
+def fetch_regions():
     """
-    Retrieve a list of IBM Cloud VPC regions
+    Retrieve a list of IBM Cloud VPC regions from the API
     """
     service = ibm_vpc.VpcV1(authenticator=authenticator)
     service.set_service_url('https://us-south.iaas.cloud.ibm.com/v1')
@@ -89,6 +91,21 @@ def get_regions():
         sys.exit()
 
 
+"""
+Region list cached across runs (see common/region_catalog.py for settings). Regions
+that failed recently are skipped instead of waiting on their timeouts again.
+"""
+region_catalog = RegionCatalog(fetch_regions)
+region_timeout = int(os.environ.get('REGION_TIMEOUT', '30'))
+
+
+def get_regions():
+    """
+    Retrieve a list of IBM Cloud VPC regions
+    """
+    return region_catalog.regions()
+
+
 def get_floating_ips():
     """
     Retrieve a list of IBM Cloud VPC floating IPs across all regions
@@ -98,10 +115,19 @@ def get_floating_ips():
     for region in regions:
         service = ibm_vpc.VpcV1(authenticator=authenticator)
         service.set_service_url(f'https://{region}.iaas.cloud.ibm.com/v1')
-        response = service.list_floating_ips().get_result()
+        service.set_http_config({'timeout': region_timeout})
+        start = time.perf_counter()
+        try:
+            response = service.list_floating_ips().get_result()
+        except Exception as e:
+            logging.error("Unable to list floating IPs in %s: %s", region, e)
+            region_catalog.record(region, error=e)
+            continue
+        region_catalog.record(region, seconds=time.perf_counter() - start)
         for fip in response['floating_ips']:
             ip_address = fip['address']
             floating_ips.append(ip_address)
+    region_catalog.save()
     return floating_ips
 
 
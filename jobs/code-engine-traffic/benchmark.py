@@ -10,6 +10,8 @@ import os
 from sys import stdout
 import ibm_boto3
 from ibm_botocore.client import Config, ClientError
+from cos_upload import upload_object
+from cos_endpoint import resolve_cos_endpoint
 
 load_dotenv()
 
@@ -25,14 +27,7 @@ cos_bucket = os.environ.get('CLOUD_OBJECT_STORAGE_BUCKET')
 if not cos_bucket:
     raise ValueError("CLOUD_OBJECT_STORAGE_BUCKET environment variable not found. Make sure you set this in Code Engine.")
 
-# Check if 'CE_JOB' environment variable exists and is not empty, if so, use private endpoint
-if os.environ.get('CE_JOB', ''):
-    cos_endpoint = "https://s3.direct.us-south.cloud-object-storage.appdomain.cloud"
-else:
-    cos_endpoint = "https://s3.us-south.cloud-object-storage.appdomain.cloud"
-
-# Current list avaiable at https://control.cloud-object-storage.cloud.ibm.com/v2/endpoints
-# this returns a json list, it may be possible to use the endpoint based on the location of the code engine project. For example, if the code engine project is in Dallas, the endpoint would be s3.us-south.cloud-object-storage.appdomain.cloud. The region is in the CE subdomain assigned to all project resources. 
+cos_endpoint = resolve_cos_endpoint(bucket=cos_bucket)
 
 # Create client 
 cos = ibm_boto3.client("s3",
@@ -110,7 +105,7 @@ def main(n, c, url):
 def create_text_file(file_text, bucket_name, item_name):
     print("Creating new item: {0}".format(item_name))
     try:
-        cos.put_object(Body=file_text, Bucket=bucket_name, Key=item_name)
+        upload_object(cos, bucket_name, item_name, file_text, content_type="application/json")
         print("Item: {0} created!".format(item_name))
     except ClientError as be:
         print("CLIENT ERROR: {0}\n".format(be))
@@ -130,9 +130,7 @@ def get_resource_service_keys():
     results = ic(all_results)
     return results
 
-## need to add try statements here with explicit error handling
-@cli.command()
-def get_resource_groups():
+def list_resource_groups():
     account_id = get_account_id()
     client = resource_manager_client()
     try:
@@ -140,151 +138,111 @@ def get_resource_groups():
             account_id=account_id
         ).get_result()
         return resource_group_list
-    
+
     except ApiException as e:
         logging.error("API exception {}.".format(str(e)))
         quit(1)
 
+def resource_instance_row(result):
+    crn_slug = extract_service_name(result.get('crn')) if 'crn' in result else None
+    is_type = extract_is_type(result.get('crn')) if 'crn' in result and crn_slug == 'is' else None
+
+    resource_instance = {
+        'name': result.get('name'),
+        'type': result.get('type'),
+        'resource_id': result.get('resource_id'),
+        'crn_slug': crn_slug,
+        'created_by': result.get('created_by'),
+        'crn': result.get('crn'),
+        'id': result.get('id'),
+        'resource_group_id': result.get('resource_group_id')
+    }
+
+    if is_type:
+        resource_instance['is_type'] = is_type
+    return resource_instance
+
+def resource_inventory(page_limit=100):
+    """Page through every resource instance in the account once and return (resource groups, DataFrame).
+
+    The API calls scale with the number of instances, not with groups times pages;
+    rows are split per resource group in memory.
+    """
+    resource_groups = list_resource_groups().get("resources")
+    pager = ResourceInstancesPager(
+        client=resource_controller_client(),
+        limit=page_limit
+    )
+    resource_instances = []
+    while pager.has_next():
+        next_page = pager.get_next()
+        assert next_page is not None
+        resource_instances.extend(resource_instance_row(result) for result in next_page)
+
+    columns = ['name', 'type', 'resource_id', 'crn_slug', 'created_by', 'crn', 'id', 'resource_group_id', 'is_type']
+    return resource_groups, pd.DataFrame(resource_instances, columns=columns)
+
+def write_inventory_workbook(path='resource_groups.xlsx'):
+    """Write one sheet per resource group from a single inventory pass."""
+    resource_groups, inventory = resource_inventory()
+    by_group = dict(tuple(inventory.groupby('resource_group_id', sort=False)))
+    empty = inventory.iloc[0:0]
+
+    with pd.ExcelWriter(path, engine='openpyxl') as writer:
+        for group in resource_groups:
+            df = by_group.get(group["id"], empty)
+            # Excel sheet names are limited to 31 characters
+            df.drop(columns=['id', 'resource_group_id']).to_excel(writer, sheet_name=group["name"][:31], index=False)
+    return inventory
+
+## need to add try statements here with explicit error handling
+@cli.command()
+def get_resource_groups():
+    return list_resource_groups()
+
 
 @cli.command()
 def get_resources_by_group():
-    rc_client = resource_controller_client()
-    resource_groups = get_resource_groups()
-    
-    # Create a new Excel writer object
-    writer = pd.ExcelWriter('resource_groups.xlsx', engine='openpyxl')
-    
-    for group in resource_groups.get("resources"):
-        resource_group_id = group["id"]
-        pager = ResourceInstancesPager(
-            client=rc_client,
-            resource_group_id=resource_group_id
-            )
-        all_results = []
-        while pager.has_next():
-            next_page = pager.get_next()
-            assert next_page is not None
-            all_results.extend(next_page)
-        
-        resource_instances = []
-        for result in all_results:
-            crn_slug = extract_service_name(result.get('crn')) if 'crn' in result else None
-            is_type = extract_is_type(result.get('crn')) if 'crn' in result and crn_slug == 'is' else None
-
-            resource_instance = {
-                'name': result.get('name'),
-                'type': result.get('type'),
-                'resource_id': result.get('resource_id'),
-                'crn_slug': crn_slug,
-                'created_by': result.get('created_by'),
-                'crn': result.get('crn')
-            }
-
-            if is_type:
-                resource_instance['is_type'] = is_type
-            
-            resource_instances.append(resource_instance)
-        
-        df = pd.DataFrame(resource_instances)
-        
-        df.to_excel(writer, sheet_name=group["name"], index=False)
-    
-    writer.save()
+    write_inventory_workbook()
 
 
 @cli.command()
 def write_resources_by_group():
-    rc_client = resource_controller_client()
-    resource_groups = get_resource_groups()
-    
-    # Create a new Excel writer object
-    writer = pd.ExcelWriter('resource_groups.xlsx', engine='openpyxl')
-    
-    for group in resource_groups.get("resources"):
-        resource_group_id = group["id"]
-        pager = ResourceInstancesPager(
-            client=rc_client,
-            resource_group_id=resource_group_id
-            )
-        all_results = []
-        while pager.has_next():
-            next_page = pager.get_next()
-            assert next_page is not None
-            all_results.extend(next_page)
-        
-        resource_instances = []
-        for result in all_results:
-            crn_slug = extract_service_name(result.get('crn')) if 'crn' in result else None
-            is_type = extract_is_type(result.get('crn')) if 'crn' in result and crn_slug == 'is' else None
-
-            resource_instance = {
-                'name': result.get('name'),
-                'type': result.get('type'),
-                'resource_id': result.get('resource_id'),
-                'crn_slug': crn_slug,
-                'created_by': result.get('created_by'),
-                'crn': result.get('crn')
-            }
-
-            if is_type:
-                resource_instance['is_type'] = is_type
-            
-            resource_instances.append(resource_instance)
-        
-        # Convert the list of dictionaries to a DataFrame
-        df = pd.DataFrame(resource_instances)
-        
-        # Write the DataFrame to an Excel sheet named after the resource group
-        df.to_excel(writer, sheet_name=group["name"], index=False)
-    
-    # Save the Excel file
-    writer.save()
+    inventory = write_inventory_workbook()
+    print(f"Wrote {len(inventory)} resource instances to resource_groups.xlsx")
 
 
 @cli.command()
 def write_excel():
-    account_id = get_account_id()
-    rc_client = resource_controller_client()
-    rm_client = resource_manager_client()
-    resource_group_list = rm_client.list_resource_groups(
-        account_id=account_id
-    ).get_result()
-    
+    resource_groups, inventory = resource_inventory()
+    by_group = dict(tuple(inventory.groupby('resource_group_id', sort=False)))
+
     # Create a new workbook
     wb = Workbook()
     # Remove the default sheet
     wb.remove(wb.active)
-    
-    for group in resource_group_list["resources"]:
-        resource_group_id = group["id"]
-        resource_group_name = group["name"]
-        resource_list = rc_client.list_resource_instances(
-            resource_group_id=resource_group_id
-        ).get_result()
-        
-        result = resource_list.get("resources")
-        crn_slug = extract_service_name(result.get('crn')) if 'crn' in result else None
-        is_type = extract_is_type(result.get('crn')) if 'crn' in result and crn_slug == 'is' else None
-        if is_type:
-            result['is_type'] = is_type
-            # Create a new sheet for each resource group
-        ws = wb.create_sheet(title=resource_group_name)
-        
+
+    for group in resource_groups:
+        # Create a new sheet for each resource group
+        ws = wb.create_sheet(title=group["name"][:31])
+
         # Write the headers
         headers = ["Resource Name", "Resource Type", "Resource ID", "CRN Slug", "Created By", "IS Type"]
         for col_num, column_title in enumerate(headers, 1):
             col_letter = get_column_letter(col_num)
             ws['{}1'.format(col_letter)] = column_title
-        
+
         # Write the resources
-        for row_num, resource in enumerate(result, 2):
-            ws.cell(row=row_num, column=1, value=resource["name"])
-            ws.cell(row=row_num, column=2, value=resource["resource_id"])
-            ws.cell(row=row_num, column=3, value=resource["id"])
-            ws.cell(row=row_num, column=4, value=crn_slug)
-            ws.cell(row=row_num, column=5, value=resource["created_by"])
-            ws.cell(row=row_num, column=6, value=is_type)
-    
+        if group["id"] not in by_group:
+            continue
+        for row_num, resource in enumerate(by_group[group["id"]].itertuples(index=False), 2):
+            ws.cell(row=row_num, column=1, value=resource.name)
+            ws.cell(row=row_num, column=2, value=resource.resource_id)
+            ws.cell(row=row_num, column=3, value=resource.id)
+            ws.cell(row=row_num, column=4, value=resource.crn_slug)
+            ws.cell(row=row_num, column=5, value=resource.created_by)
+            ws.cell(row=row_num, column=6, value=None if pd.isna(resource.is_type) else resource.is_type)
+
     # Save the workbook
     wb.save("resource_groups.xlsx")
 
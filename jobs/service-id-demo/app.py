@@ -2,6 +2,7 @@
 
 import os
 import json
+from pathlib import Path
 import click
 import logging
 from ibm_platform_services import IamIdentityV1
@@ -14,6 +15,8 @@ import pandas as pd
 import pytz
 import ibm_boto3
 from ibm_botocore.client import Config, ClientError
+from cos_upload import upload_object
+from cos_endpoint import resolve_cos_endpoint
 
 ibmcloud_api_key = os.environ.get('IBMCLOUD_API_KEY')
 if not ibmcloud_api_key:
@@ -31,11 +34,7 @@ cos_bucket = os.environ.get('CLOUD_OBJECT_STORAGE_BUCKET')
 if not cos_bucket:
     raise ValueError("CLOUD_OBJECT_STORAGE_BUCKET environment variable not found. Make sure you set this in Code Engine.")
 
-# Check if 'CE_JOB' environment variable exists and is not empty, if so, use private endpoint
-if os.environ.get('CE_JOB', ''):
-    cos_endpoint = "https://s3.direct.us-south.cloud-object-storage.appdomain.cloud"
-else:
-    cos_endpoint = "https://s3.us-south.cloud-object-storage.appdomain.cloud"
+cos_endpoint = resolve_cos_endpoint(bucket=cos_bucket)
 
 
 def setup_logging(default_path='logging.json', default_level=logging.info, env_key='LOG_CFG'):
@@ -202,7 +201,8 @@ def filter_and_export_service_ids():
     item_name = f"{current_datetime}-filtered-service-ids.xlsx"
     print("Filtered service IDs have been written to 'filtered_service_ids.xlsx'")
     try:
-        cos.put_object(Body=df, Bucket=cos_bucket, Key=item_name)
+        upload_object(cos, cos_bucket, item_name, Path('filtered_service_ids.xlsx'),
+                      content_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
         print("Item: {0} created!".format(item_name))
     except ClientError as be:
         print("CLIENT ERROR: {0}\n".format(be))
@@ -15,22 +15,73 @@
 #
 
 import os
+import io
+import csv
 import sys
 import json
+import time
+import tempfile
+import hashlib
 import logging
 from datetime import datetime
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
 import click
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from dateutil.relativedelta import relativedelta
+import ibm_boto3
+from ibm_botocore.client import Config
 from ibm_platform_services import IamIdentityV1, UsageReportsV4
 from ibm_cloud_sdk_core.authenticators import IAMAuthenticator
 from ibm_cloud_sdk_core import ApiException
 from rich.console import Console
 from rich.table import Table
+from cos_upload import upload_object
+from cos_endpoint import resolve_cos_endpoint
 
 
 ibmcloud_api_key = os.environ.get('IBMCLOUD_API_KEY')
 if not ibmcloud_api_key:
     raise ValueError("IBMCLOUD_API_KEY environment variable not found")
 
+# Usage is cached as Parquet partitioned by month, under
+# USAGE_CACHE_DIR/<account id>/<usage|instances>/billing_month=<YYYY-MM>/part.parquet. A file
+# is kept for good once it was written more than USAGE_FINALIZE_DAYS after its month ended,
+# when late charges have been billed; any other file, including one written while its month
+# was still open, is refetched once it is older than USAGE_CACHE_TTL seconds.
+usage_cache_dir = os.environ.get('USAGE_CACHE_DIR', '.usage-cache')
+current_month_ttl = int(os.environ.get('USAGE_CACHE_TTL', '3600'))
+finalize_days = int(os.environ.get('USAGE_FINALIZE_DAYS', '5'))
+
+# Usage API statuses worth retrying: 424 while a month's report is still being prepared, 429 when throttled
+retry_statuses = (424, 429)
+
+# One row per resource, plan and billable metric
+usage_dtypes = {
+    'resource_id': 'string', 'resource_name': 'string', 'plan_id': 'string', 'plan_name': 'string',
+    'pricing_region': 'string', 'billable': 'boolean', 'plan_cost': 'float64', 'metric': 'string',
+    'metric_name': 'string', 'unit': 'string', 'quantity': 'float64', 'rateable_quantity': 'float64',
+    'cost': 'float64', 'rated_cost': 'float64'
+}
+
+# One row per resource instance and metric, from the instance-level usage report
+instance_usage_dtypes = {
+    'resource_instance_id': 'string', 'resource_instance_name': 'string', 'resource_id': 'string',
+    'resource_name': 'string', 'resource_group_id': 'string', 'resource_group_name': 'string',
+    'plan_id': 'string', 'plan_name': 'string', 'region': 'string', 'metric': 'string',
+    'metric_name': 'string', 'unit': 'string', 'quantity': 'float64', 'cost': 'float64'
+}
+
+# Columns each report groups by, and whether it needs instance-level usage
+report_groupings = {
+    'resource': ['resource_id', 'resource_name'],
+    'plan': ['resource_name', 'plan_name', 'pricing_region'],
+    'metric': ['resource_name', 'metric_name', 'unit'],
+    'resource_group': ['resource_group_name']
+}
+
 
 def setup_logging(default_path='logging.json', default_level=logging.info, env_key='LOG_CFG'):
     """
@@ -84,11 +135,20 @@ def usage_client():
 
 def get_account_id():
     """
-    Retrieves the account ID associated with the API key.
+    Retrieves the account ID associated with the API key, from the cache when possible.
 
     Returns:
         str: The account ID.
     """
+    accounts_path = os.path.join(usage_cache_dir, 'accounts.json')
+    key_hash = hashlib.sha256(ibmcloud_api_key.encode('utf-8')).hexdigest()
+    accounts = {}
+    if os.path.exists(accounts_path):
+        with open(accounts_path, 'rt', encoding='utf-8') as f:
+            accounts = json.load(f)
+    if key_hash in accounts:
+        return accounts[key_hash]
+
     try:
         client = iam_client()
         api_key = client.get_api_keys_details(
@@ -98,9 +158,317 @@ def get_account_id():
         logging.error("API exception %s.", str(e))
         sys.exit(0)
     account_id = api_key["account_id"]
+    accounts[key_hash] = account_id
+    os.makedirs(usage_cache_dir, exist_ok=True)
+    with open(accounts_path, 'wt', encoding='utf-8') as f:
+        json.dump(accounts, f)
     return account_id
 
 
+def usage_frame(usage):
+    """
+    Flattens an account usage response into one row per resource, plan and metric.
+
+    Args:
+        usage (dict): Result of UsageReportsV4.get_account_usage.
+
+    Returns:
+        pandas.DataFrame: Usage rows with the columns in usage_columns.
+    """
+    rows = []
+    for resource in usage['resources']:
+        for plan in resource['plans']:
+            plan_row = {
+                'resource_id': resource['resource_id'],
+                'resource_name': resource.get('resource_name'),
+                'plan_id': plan['plan_id'],
+                'plan_name': plan.get('plan_name'),
+                'pricing_region': plan.get('pricing_region'),
+                'billable': plan.get('billable'),
+                'plan_cost': plan.get('cost', 0)
+            }
+            # Plans without metrics still get a row so their cost is not lost
+            for metric in plan.get('usage') or [{}]:
+                rows.append({
+                    **plan_row,
+                    'metric': metric.get('metric'),
+                    'metric_name': metric.get('metric_name'),
+                    'unit': metric.get('unit'),
+                    'quantity': metric.get('quantity'),
+                    'rateable_quantity': metric.get('rateable_quantity'),
+                    'cost': metric.get('cost'),
+                    'rated_cost': metric.get('rated_cost')
+                })
+    return pd.DataFrame(rows, columns=list(usage_dtypes)).astype(usage_dtypes)
+
+
+def instance_usage_rows(resources):
+    """
+    Yields one row per instance and metric from instance-level usage records.
+
+    Args:
+        resources (iterable): Records from UsageReportsV4.get_resource_usage_account.
+    """
+    for instance in resources:
+        instance_row = {key: instance.get(key) for key in list(instance_usage_dtypes)[:9]}
+        for metric in instance.get('usage') or [{}]:
+            yield {
+                **instance_row,
+                'metric': metric.get('metric'),
+                'metric_name': metric.get('metric_name'),
+                'unit': metric.get('unit'),
+                'quantity': metric.get('quantity'),
+                'cost': metric.get('cost')
+            }
+
+
+def instance_usage_frame(resources):
+    """
+    Flattens instance-level usage records into one row per instance and metric.
+
+    Args:
+        resources (iterable): Records from UsageReportsV4.get_resource_usage_account.
+
+    Returns:
+        pandas.DataFrame: Usage rows with the columns in instance_usage_dtypes.
+    """
+    rows = list(instance_usage_rows(resources))
+    return pd.DataFrame(rows, columns=list(instance_usage_dtypes)).astype(instance_usage_dtypes)
+
+
+def iter_batches(rows, size):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def iter_usage_csv(rows, batch_size=5000):
+    """
+    Yields CSV text for the rows, header first, one chunk per batch of rows.
+    """
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=list(instance_usage_dtypes))
+    writer.writeheader()
+    for batch in iter_batches(rows, batch_size):
+        writer.writerows(batch)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def write_usage_parquet(rows, path, row_group_size=50000):
+    """
+    Writes the rows to a Parquet file one row group at a time.
+
+    Returns:
+        int: Number of rows written.
+    """
+    schema = pa.schema([(name, pa.float64() if dtype == 'float64' else pa.string())
+                        for name, dtype in instance_usage_dtypes.items()])
+    count = 0
+    with pq.ParquetWriter(path, schema, compression='zstd') as writer:
+        for batch in iter_batches(rows, row_group_size):
+            writer.write_table(pa.Table.from_pylist(batch, schema=schema))
+            count += len(batch)
+    return count
+
+
+def cos_client(cos_bucket):
+    """
+    Creates a COS client from the Object Storage binding in the Code Engine project.
+    """
+    return ibm_boto3.client("s3",
+        ibm_api_key_id=os.environ.get('CLOUD_OBJECT_STORAGE_APIKEY'),
+        ibm_service_instance_id=os.environ.get('CLOUD_OBJECT_STORAGE_RESOURCE_INSTANCE_ID'),
+        config=Config(signature_version="oauth"),
+        ibm_auth_endpoint="https://iam.cloud.ibm.com/identity/token",
+        endpoint_url=resolve_cos_endpoint(bucket=cos_bucket)
+    )
+
+
+def usage_cache_path(account_id, usage_month, dataset='usage'):
+    return os.path.join(usage_cache_dir, account_id, dataset, f"billing_month={usage_month}", "part.parquet")
+
+
+def with_retry(call, attempts=5, delay=1.0):
+    """
+    Calls a usage API function, retrying with exponential backoff on 424 and 429.
+
+    Args:
+        call (callable): Function making the API call.
+        attempts (int, optional): Total number of tries. Defaults to 5.
+        delay (float, optional): Seconds before the first retry, doubled each time. Defaults to 1.0.
+    """
+    for attempt in range(attempts):
+        try:
+            return call()
+        except ApiException as e:
+            if e.code not in retry_statuses or attempt == attempts - 1:
+                raise
+            logging.warning("API exception %s, retrying in %ss.", str(e), delay * 2 ** attempt)
+            time.sleep(delay * 2 ** attempt)
+    return None
+
+
+def previous_months(count, closed_only=False):
+    """
+    Returns the last count billing months as YYYY-MM, oldest first.
+
+    Args:
+        count (int): Number of months.
+        closed_only (bool, optional): End with last month instead of the current one.
+    """
+    end = datetime.now().replace(day=1) - relativedelta(months=1 if closed_only else 0)
+    return [(end - relativedelta(months=offset)).strftime("%Y-%m") for offset in range(count - 1, -1, -1)]
+
+
+def cache_is_fresh(path, usage_month):
+    if not os.path.exists(path):
+        return False
+    written = os.path.getmtime(path)
+    finalized = datetime.strptime(usage_month, "%Y-%m") + relativedelta(months=1, days=finalize_days)
+    if written >= finalized.timestamp():
+        return True
+    return time.time() - written < current_month_ttl
+
+
+def load_usage(usage_month=None, account_id=None):
+    """
+    Returns the account usage for a billing month, fetching it only when the cache is cold.
+
+    Args:
+        usage_month (str, optional): Billing month as YYYY-MM. Defaults to the current month.
+        account_id (str, optional): Account to report on. Defaults to the API key's account.
+
+    Raises:
+        ApiException: If the usage is not cached and the API call fails.
+
+    Returns:
+        pandas.DataFrame: Usage rows, see usage_frame.
+    """
+    usage_month = usage_month or datetime.now().strftime("%Y-%m")
+    account_id = account_id or get_account_id()
+
+    def fetch():
+        usage = with_retry(lambda: usage_client().get_account_usage(
+            account_id=account_id,
+            billingmonth=usage_month,
+            names=True
+        ).get_result())
+        return usage_frame(usage)
+
+    return cached_frame(usage_cache_path(account_id, usage_month), usage_month, fetch)
+
+
+def iter_instance_usage(account_id, usage_month, page_size=200):
+    """
+    Yields instance-level usage records for a billing month, following the _start offset across pages.
+
+    Args:
+        account_id (str): Account to report on.
+        usage_month (str): Billing month as YYYY-MM.
+        page_size (int, optional): Records per API call. Defaults to 200.
+    """
+    client = usage_client()
+    start = None
+    while True:
+        result = with_retry(lambda: client.get_resource_usage_account(
+            account_id=account_id,
+            billingmonth=usage_month,
+            names=True,
+            limit=page_size,
+            start=start
+        ).get_result())
+        yield from result.get('resources', [])
+        start = (result.get('next') or {}).get('offset')
+        if not start:
+            return
+
+
+def load_instance_usage(usage_month=None, account_id=None):
+    """
+    Returns instance-level usage for a billing month, with the same caching rules as load_usage.
+
+    Returns:
+        pandas.DataFrame: Usage rows, see instance_usage_frame.
+    """
+    usage_month = usage_month or datetime.now().strftime("%Y-%m")
+    account_id = account_id or get_account_id()
+    return cached_frame(usage_cache_path(account_id, usage_month, 'instances'), usage_month,
+                        lambda: instance_usage_frame(iter_instance_usage(account_id, usage_month)))
+
+
+def cached_frame(path, usage_month, fetch):
+    if cache_is_fresh(path, usage_month):
+        logging.debug("Using cached usage %s", path)
+        return pd.read_parquet(path)
+    df = fetch()
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Dot-prefixed so Parquet dataset readers skip a partial file
+    tmp_path = os.path.join(os.path.dirname(path), f".{os.path.basename(path)}.tmp")
+    df.to_parquet(tmp_path, index=False, compression='zstd')
+    os.replace(tmp_path, path)
+    return df
+
+
+def plan_costs(df):
+    """
+    Returns one row per resource plan with its cost.
+
+    Args:
+        df (pandas.DataFrame): Usage rows from load_usage.
+
+    Returns:
+        pandas.DataFrame: resource and plan columns plus plan_cost.
+    """
+    keys = ['resource_id', 'resource_name', 'plan_id', 'plan_name', 'pricing_region']
+    return df.drop_duplicates(subset=keys)[keys + ['plan_cost']]
+
+
+def aggregate_usage(usage_month=None, by='resource', top=None):
+    """
+    Totals usage cost for a billing month grouped by resource, plan, metric or resource group.
+
+    Costs are summed at full precision and only rounded for display. Resource and plan
+    totals use plan costs, metric totals use metric costs and resource group totals
+    use instance-level usage.
+
+    Args:
+        usage_month (str, optional): Billing month as YYYY-MM. Defaults to the current month.
+        by (str, optional): One of report_groupings. Defaults to 'resource'.
+        top (int, optional): Only return the top N cost drivers.
+
+    Returns:
+        tuple: (pandas.DataFrame of groups sorted by cost, total cost)
+    """
+    keys = report_groupings[by]
+    if by == 'resource_group':
+        df = load_instance_usage(usage_month)
+        cost = 'cost'
+    elif by == 'metric':
+        df = load_usage(usage_month)
+        cost = 'cost'
+    else:
+        df = plan_costs(load_usage(usage_month))
+        cost = 'plan_cost'
+    grouped = (df.groupby(keys, dropna=False, sort=False, observed=True)[cost].sum()
+               .rename('cost').reset_index())
+    if by == 'metric':
+        quantities = df.groupby(keys, dropna=False, sort=False, observed=True)['quantity'].sum()
+        grouped['quantity'] = quantities.to_numpy()
+    total_cost = float(grouped['cost'].sum())
+    grouped = grouped.nlargest(top, 'cost') if top else grouped.sort_values('cost', ascending=False)
+    grouped['share'] = grouped['cost'] / total_cost if total_cost else 0.0
+    return grouped, total_cost
+
+
 @click.group()
 def cli():
     """Group to hold our commands"""
@@ -156,31 +524,16 @@ def get_current_month_usage():
         list: The usage data for the current month.
     """
 
-    account_id = get_account_id()
-    client = usage_client()
     data = []
-    usage_month = datetime.now().strftime("%Y-%m")
 
     try:
-        usage = client.get_account_usage(
-            account_id=account_id,
-            billingmonth=usage_month,
-            names=True
-        ).get_result()
-
-        total_cost = 0
+        plans = plan_costs(load_usage())
 
-        for resource in usage['resources']:
-            name = resource['resource_name']
-            for plan in resource['plans']:
-                cost = plan['cost']
-                resource_type = resource['resource_id']
-                rounded_cost = round(cost, 4)
-                total_cost += rounded_cost
-                print(f"Resource Name: {name}, Cost: {rounded_cost},"
-                    f"Resource Type: {resource_type}")
+        for plan in plans.itertuples(index=False):
+            print(f"Resource Name: {plan.resource_name}, Cost: {round(plan.plan_cost, 4)},"
+                f"Resource Type: {plan.resource_id}")
 
-        print(f"\nTotal Cost: {round(total_cost, 4)}")
+        print(f"\nTotal Cost: {round(float(plans['plan_cost'].sum()), 4)}")
 
     except ApiException as e:
         if e.code == 424:
@@ -209,18 +562,8 @@ def pretty_print_usage():
         None
     """
 
-    account_id = get_account_id()
-    client = usage_client()
-    usage_month = datetime.now().strftime("%Y-%m")
-
     try:
-        usage = client.get_account_usage(
-            account_id=account_id,
-            billingmonth=usage_month,
-            names=True
-        ).get_result()
-
-        resources = usage['resources']
+        plans = plan_costs(load_usage())
         console = Console()
         table = Table(show_header=True, header_style="bold magenta")
         table.add_column("Resource Name", style="dim", width=35)
@@ -229,19 +572,11 @@ def pretty_print_usage():
         table.add_column("ResourceID")
         table.add_column("Cost", justify="right")
 
-        total_cost = 0
-
-        for resource in resources:
-            resource_name = resource['resource_name']
-            resource_id = resource['resource_id']
-            for plan in resource['plans']:
-                plan_name = plan['plan_name']
-                cost = round(plan.get('cost', 0), 4)
-                total_cost += cost
-                metric_list = [f"{usage['metric_name']}" for usage in plan['usage']]
-                metric_units = ", ".join(metric_list)
-                if cost > 0:
-                    table.add_row(resource_name, plan_name, resource_id, str(cost))
+        total_cost = float(plans['plan_cost'].sum())
+        plans = plans[plans['plan_cost'].round(4) > 0]
+
+        for plan in plans.itertuples(index=False):
+            table.add_row(plan.resource_name, plan.plan_name, plan.resource_id, str(round(plan.plan_cost, 4)))
         console.print(table)
 
 
@@ -254,5 +589,169 @@ def pretty_print_usage():
         logging.error("API exception %s.", str(e))
         sys.exit(0)
 
+
+def usage_history(months, max_workers=6):
+    """
+    Loads several billing months concurrently into one plan-level table.
+
+    Months that still fail after retries are skipped with a warning.
+
+    Args:
+        months (list): Billing months as YYYY-MM.
+        max_workers (int, optional): Months fetched at the same time. Defaults to 6.
+
+    Returns:
+        pandas.DataFrame: plan_costs rows with a billing_month column.
+    """
+    account_id = get_account_id()
+
+    def load_month(usage_month):
+        try:
+            return plan_costs(load_usage(usage_month, account_id)).assign(billing_month=usage_month)
+        except ApiException as e:
+            logging.warning("Skipping %s: %s", usage_month, str(e))
+            return None
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        frames = [frame for frame in executor.map(load_month, months) if frame is not None]
+    if not frames:
+        return pd.DataFrame(columns=['resource_id', 'resource_name', 'plan_cost', 'billing_month'])
+    return pd.concat(frames, ignore_index=True)
+
+
+def usage_trends(history):
+    """
+    Computes month-over-month totals and per-resource growth from usage_history.
+
+    Returns:
+        tuple: (monthly totals with change and percent change,
+                resource x month cost pivot with change over the last month)
+    """
+    monthly = history.groupby('billing_month', sort=True)['plan_cost'].sum().rename('cost').to_frame()
+    monthly['change'] = monthly['cost'].diff()
+    monthly['change_pct'] = monthly['cost'].pct_change(fill_method=None)
+    by_resource = history.pivot_table(index='resource_name', columns='billing_month', values='plan_cost',
+                                      aggfunc='sum', fill_value=0.0, observed=True)
+    if by_resource.shape[1] > 1:
+        by_resource['change'] = by_resource.iloc[:, -1] - by_resource.iloc[:, -2]
+    else:
+        by_resource['change'] = 0.0
+    return monthly, by_resource.sort_values('change', key=lambda change: change.abs(), ascending=False)
+
+
+@cli.command()
+@click.option('--months', default=12, show_default=True, help='Number of billing months to report on.')
+@click.option('--closed-only', is_flag=True, help='Leave out the current, still open, month.')
+@click.option('--top', default=10, show_default=True, help='Resources with the largest change to show.')
+@click.option('--workers', default=6, show_default=True, help='Months fetched at the same time.')
+def get_usage_history(months, closed_only, top, workers):
+    """
+    Prints month-over-month usage cost and the resources whose cost changed the most.
+    """
+
+    history = usage_history(previous_months(months, closed_only), max_workers=workers)
+    if history.empty:
+        logging.warning("No usage found for the requested months.")
+        return
+    monthly, by_resource = usage_trends(history)
+
+    console = Console()
+    table = Table(show_header=True, header_style="bold magenta")
+    table.add_column("Month")
+    table.add_column("Cost", justify="right")
+    table.add_column("Change", justify="right")
+    table.add_column("Change %", justify="right")
+    for month, row in monthly.iterrows():
+        table.add_row(month, str(round(row['cost'], 4)),
+                      "" if pd.isna(row['change']) else str(round(row['change'], 4)),
+                      "" if pd.isna(row['change_pct']) else f"{row['change_pct']:.1%}")
+    console.print(table)
+
+    month_columns = list(by_resource.columns[-3:-1]) if by_resource.shape[1] > 2 else list(by_resource.columns[:-1])
+    growth = Table(show_header=True, header_style="bold magenta")
+    growth.add_column("Resource Name", style="dim", width=35)
+    for month in month_columns:
+        growth.add_column(month, justify="right")
+    growth.add_column("Change", justify="right")
+    for resource_name, row in by_resource.head(top).iterrows():
+        growth.add_row(str(resource_name), *[str(round(row[month], 4)) for month in month_columns],
+                       str(round(row['change'], 4)))
+    console.print(growth)
+
+
+@cli.command()
+@click.option('--month', 'usage_month', default=None, help='Billing month as YYYY-MM. Defaults to the current month.')
+@click.option('--output-format', type=click.Choice(['csv', 'parquet']), default='csv', show_default=True,
+              help='gzip compressed CSV, or zstd compressed Parquet.')
+@click.option('--bucket', 'cos_bucket', envvar='CLOUD_OBJECT_STORAGE_BUCKET', required=True,
+              help='COS bucket to upload to. Defaults to CLOUD_OBJECT_STORAGE_BUCKET.')
+def export_instance_usage(usage_month, output_format, cos_bucket):
+    """
+    Streams instance-level usage for a billing month to COS for chargeback.
+
+    Pages are fetched one at a time and written out as they arrive, so memory use
+    does not grow with the number of instances. CSV is gzipped straight into a
+    multipart upload; Parquet is written row group by row group to a temporary
+    file that is then uploaded in parts.
+    """
+
+    usage_month = usage_month or datetime.now().strftime("%Y-%m")
+    account_id = get_account_id()
+    rows = instance_usage_rows(iter_instance_usage(account_id, usage_month))
+    cos = cos_client(cos_bucket)
+    current_datetime = datetime.now().strftime("%Y-%m-%d-%H-%M")
+
+    try:
+        if output_format == 'csv':
+            item_name = f"{current_datetime}-{account_id}-{usage_month}-instance-usage.csv.gz"
+            result = upload_object(cos, cos_bucket, item_name, iter_usage_csv(rows),
+                                   compress=True, content_type="text/csv")
+        else:
+            item_name = f"{current_datetime}-{account_id}-{usage_month}-instance-usage.parquet"
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                path = Path(tmp_dir, 'instance-usage.parquet')
+                row_count = write_usage_parquet(rows, path)
+                logging.info("Wrote %d usage rows to %s", row_count, path)
+                result = upload_object(cos, cos_bucket, item_name, path,
+                                       content_type="application/vnd.apache.parquet")
+    except ApiException as e:
+        logging.error("API exception %s.", str(e))
+        sys.exit(0)
+    print(json.dumps(result))
+
+
+@cli.command()
+@click.option('--by', 'group_by', type=click.Choice(list(report_groupings)), default='resource',
+              help='Group costs by resource, plan, metric or resource group.')
+@click.option('--top', type=int, default=None, help='Only show the top N cost drivers.')
+@click.option('--month', 'usage_month', default=None, help='Billing month as YYYY-MM. Defaults to the current month.')
+def usage_report(group_by, top, usage_month):
+    """
+    Prints usage cost grouped by resource, plan, metric or resource group, largest first.
+    """
+
+    try:
+        grouped, total_cost = aggregate_usage(usage_month, by=group_by, top=top)
+    except ApiException as e:
+        logging.error("API exception %s.", str(e))
+        sys.exit(0)
+
+    console = Console()
+    table = Table(show_header=True, header_style="bold magenta")
+    for column in report_groupings[group_by]:
+        table.add_column(column.replace('_', ' ').title())
+    if group_by == 'metric':
+        table.add_column("Quantity", justify="right")
+    table.add_column("Cost", justify="right")
+    table.add_column("Share", justify="right")
+    for row in grouped.itertuples(index=False):
+        values = [str(getattr(row, column)) for column in report_groupings[group_by]]
+        if group_by == 'metric':
+            values.append(f"{row.quantity:,.2f}")
+        values += [str(round(row.cost, 4)), f"{row.share:.1%}"]
+        table.add_row(*values)
+    console.print(table)
+    console.print(f"[bold]Total Cost: {round(total_cost, 4)}[/bold]")
+
 if __name__ == '__main__':
     cli()
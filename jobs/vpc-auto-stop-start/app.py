@@ -15,15 +15,21 @@
 
 import os
 import json
-import sys
 import time
 import logging
+import threading
+from datetime import datetime
+from zoneinfo import ZoneInfo
+from urllib.parse import urlparse, parse_qs
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import httpx
 import click
 import ibm_vpc
 from ibm_vpc import VpcV1
+from ibm_platform_services import GlobalSearchV2
 from ibm_cloud_sdk_core.authenticators import IAMAuthenticator
 from ibm_cloud_sdk_core import ApiException
+from region_catalog import RegionCatalog
 
 ibmcloud_api_key = os.environ.get('IBMCLOUD_API_KEY')
 if not ibmcloud_api_key:
@@ -34,6 +40,46 @@ if not ignore_group:
     ignore_group = []
 ignore_group = [name.strip() for name in os.environ.get('IGNORE_GROUP', '').split(',') if name.strip()]
 
+# Optional server-side filters applied to every list_instances call
+instance_filters = {name: value for name, value in (
+    ('resource_group_id', os.environ.get('RESOURCE_GROUP_ID')),
+    ('vpc_id', os.environ.get('VPC_ID'))
+) if value}
+
+# Statuses in which an instance already is, or is heading to, the action's target state
+settled_statuses = {
+    'stop': {'stopped', 'stopping'},
+    'start': {'running', 'starting'}
+}
+
+# Upper bound on concurrent VPC API calls across all regions
+max_workers = int(os.environ.get('MAX_WORKERS', '16'))
+
+# Seconds to wait for started instances to reach running, and the poll backoff bounds
+ready_timeout = int(os.environ.get('READY_TIMEOUT', '900'))
+poll_initial_delay = 5
+poll_max_delay = 60
+
+# Policy mode: instances carry a user tag like schedule:weekday-9-18 (running 09:00-18:00 on
+# weekdays, stopped otherwise). A window may cross midnight: daily-22-6 runs 22:00-06:00. Instances without a tag fall back to their resource group's
+# schedule from SCHEDULE_RESOURCE_GROUPS, e.g. {"dev": "weekday-8-20"}; others are left alone.
+schedule_tag_prefix = 'schedule:'
+# Both are parsed by apply_schedules so a bad value does not break the stop and start commands
+schedule_timezone = os.environ.get('SCHEDULE_TIMEZONE', 'UTC')
+schedule_resource_groups = os.environ.get('SCHEDULE_RESOURCE_GROUPS', '{}')
+schedule_days = {
+    'daily': set(range(7)),
+    'weekday': set(range(5)),
+    'weekend': {5, 6}
+}
+
+# Seconds before a call to one region's VPC API gives up
+region_timeout = int(os.environ.get('REGION_TIMEOUT', '30'))
+
+# One VpcV1 client per region; set_service_url() on a shared client is not safe across threads
+regional_clients = {}
+regional_clients_lock = threading.Lock()
+
 
 def setup_logging(default_path='logging.json', default_level=logging.info, env_key='LOG_CFG'):
     path = default_path
@@ -58,43 +104,114 @@ def vpc_client():
 
 
 
-def get_iam_token():
-    try:
+class RunLogger:
+    """Collects log records for one run and sends them to IBM Cloud Logs in size-bounded batches.
+
+    The IAM token is cached until a minute before it expires and every batch goes
+    over the same pooled httpx client. Records are only kept locally when
+    LOGGING_URL is not set.
+
+    Args:
+        application_name: applicationName on every record
+        max_batch_records: flush once this many records are waiting
+        max_batch_bytes: upper bound on the JSON size of one request
+    """
+
+    def __init__(self, application_name, max_batch_records=500, max_batch_bytes=1024 * 1024):
+        self.application_name = application_name
+        self.logging_url = os.environ.get('LOGGING_URL')
+        self.max_batch_records = max_batch_records
+        self.max_batch_bytes = max_batch_bytes
+        self.http = httpx.Client(timeout=30.0)
+        self.records = []
+        # Guards records and the counters; never held while a batch is sent
+        self.lock = threading.Lock()
+        self.token_lock = threading.Lock()
+        self.iam_token = None
+        self.iam_token_expiration = 0
+        self.sent = 0
+        self.failed = 0
+        self.flush_seconds = 0.0
+        if not self.logging_url:
+            print("LOGGING_URL not set, action records will not be sent to IBM Cloud Logs")
+
+    def get_iam_token(self):
+        with self.token_lock:
+            return self._get_iam_token()
+
+    def _get_iam_token(self):
+        if self.iam_token and time.time() < self.iam_token_expiration - 60:
+            return self.iam_token
         hdrs = { 'Accept' : 'application/json', 'Content-Type' : 'application/x-www-form-urlencoded' }
         params = { 'grant_type' : 'urn:ibm:params:oauth:grant-type:apikey', 'apikey' : ibmcloud_api_key }
-        resp = httpx.post('https://iam.cloud.ibm.com/identity/token', data = params, headers = hdrs)
+        resp = self.http.post('https://iam.cloud.ibm.com/identity/token', data = params, headers = hdrs)
         resp.raise_for_status()
         response_json = resp.json()
-        iam_token  = response_json['access_token']
-        return iam_token
-
-    except httpx.HTTPError as e:
-        logging.error("HTTP exception {}.".format(str(e)))
-        sys.exit(1)
+        self.iam_token = response_json['access_token']
+        self.iam_token_expiration = response_json.get('expiration', time.time() + response_json.get('expires_in', 3600))
+        return self.iam_token
 
-def send_log_to_ibm_cloud_logs(application_name, subsystem_name, computer_name, message):
-    iam_token = get_iam_token()
-    if not iam_token:
-        raise ValueError("IAM_TOKEN environment variable not found")
+    def log(self, subsystem_name, computer_name, message, **fields):
+        record = {
+            "applicationName": self.application_name,
+            "subsystemName": subsystem_name,
+            "computerName": computer_name,
+            "text": {"message": message, **fields},
+            "category": "cat-1",
+            "className": "class-1",
+            "methodName": "method-1",
+            "threadId": threading.current_thread().name
+        }
+        with self.lock:
+            self.records.append(record)
+            if len(self.records) < self.max_batch_records:
+                return
+            records, self.records = self.records, []
+        self._send(records)
 
-    log_data = [{
-        "applicationName": application_name,
-        "subsystemName": subsystem_name,
-        "computerName": computer_name,
-        "text": {"message": message},
-        "category": "cat-1",
-        "className": "class-1",
-        "methodName": "method-1",
-        "threadId": "thread-1"
-    }]
+    def flush(self):
+        with self.lock:
+            records, self.records = self.records, []
+        self._send(records)
 
-    logging_url = os.environ.get('LOGGING_URL')
-    hdrs = { 'Content-Type' : 'application/json', "Authorization": f"{iam_token}" }
-    resp = httpx.post(logging_url, data=json.dumps(log_data), headers = hdrs)
-    resp.raise_for_status()
-    print(resp.text)
+    def _batches(self, records):
+        batch, batch_bytes = [], 2
+        for record in records:
+            size = len(json.dumps(record)) + 1
+            if batch and (len(batch) >= self.max_batch_records or batch_bytes + size > self.max_batch_bytes):
+                yield batch
+                batch, batch_bytes = [], 2
+            batch.append(record)
+            batch_bytes += size
+        if batch:
+            yield batch
 
+    def _send(self, records):
+        """Send records swapped out of the buffer; runs without self.lock so other threads keep logging."""
+        if not records or not self.logging_url:
+            return
+        start = time.perf_counter()
+        sent = failed = 0
+        for batch in self._batches(records):
+            try:
+                hdrs = { 'Content-Type' : 'application/json', "Authorization": f"{self.get_iam_token()}" }
+                resp = self.http.post(self.logging_url, content=json.dumps(batch), headers = hdrs)
+                resp.raise_for_status()
+                sent += len(batch)
+            except httpx.HTTPError as e:
+                failed += len(batch)
+                logging.error("Failed to send {} log records: {}".format(len(batch), str(e)))
+        with self.lock:
+            self.sent += sent
+            self.failed += failed
+            self.flush_seconds += time.perf_counter() - start
 
+    def close(self, summary):
+        """Queue a summary record for the run, send everything left and release the client."""
+        self.log("run-summary", "ce-job", f"{summary['action']} run finished", **summary)
+        self.flush()
+        self.http.close()
+        logging.info(f"Sent {self.sent} log records ({self.failed} failed) in {self.flush_seconds:.2f}s")
 
 
 @click.group()
@@ -103,55 +220,258 @@ def cli():
     pass
 
 
-@cli.command()
-def stop_vpc_instances():
-    client = vpc_client()
-    workloads_regions = client.list_regions().get_result()['regions']
+def fetch_region_names():
+    return [region['name'] for region in vpc_client().list_regions().get_result()['regions']]
+
+# Region list cached across runs, with regions that recently failed skipped
+region_catalog = RegionCatalog(fetch_region_names)
+
+def regional_client(region_name):
+    with regional_clients_lock:
+        if region_name not in regional_clients:
+            client = vpc_client()
+            client.set_service_url(f'https://{region_name}.iaas.cloud.ibm.com/v1')
+            client.set_http_config({'timeout': region_timeout})
+            regional_clients[region_name] = client
+        return regional_clients[region_name]
+
+def iter_region_instances(region_name):
+    """Yield every instance in a region, following next.start across pages."""
+    client = regional_client(region_name)
+    start = None
+    while True:
+        result = client.list_instances(start=start, limit=100, **instance_filters).get_result()
+        yield from result['instances']
+        next_page = result.get('next')
+        if not next_page:
+            return
+        start = parse_qs(urlparse(next_page['href']).query)['start'][0]
+
+def list_region_instances(region_name):
+    start = time.perf_counter()
+    try:
+        instances = list(iter_region_instances(region_name))
+    except Exception as e:
+        region_catalog.record(region_name, error=e)
+        raise
+    region_catalog.record(region_name, seconds=time.perf_counter() - start)
+    return region_name, instances
+
+def needs_action(instance, action):
+    """Skip instances in IGNORE_GROUP and those already in the action's target state."""
+    return instance['name'] not in ignore_group and instance['status'] not in settled_statuses[action]
+
+def list_all_instances(executor):
+    """Return (region name, instance) pairs for every region, listing regions concurrently."""
+    regions = region_catalog.regions()
+    instances = []
+    for future in as_completed([executor.submit(list_region_instances, region) for region in regions]):
+        try:
+            region_name, region_instances = future.result()
+        except Exception as e:
+            print(f"Failed to list instances: {e}")
+            continue
+        instances.extend((region_name, instance) for instance in region_instances)
+    region_catalog.save()
+    return instances
+
+def fetch_instance_tags():
+    """Return {crn: [user tags]} for every VPC instance in the account with paged Global Search calls."""
+    search_service = GlobalSearchV2(authenticator=IAMAuthenticator(apikey=ibmcloud_api_key))
+    tags_by_crn = {}
+    search_cursor = None
+    while True:
+        result = search_service.search(query='family:is AND type:instance', fields=['crn', 'tags'],
+                                       limit=1000, search_cursor=search_cursor).get_result()
+        for item in result.get('items', []):
+            tags_by_crn[item['crn']] = item.get('tags', [])
+        search_cursor = result.get('search_cursor')
+        if not search_cursor or len(result.get('items', [])) < 1000:
+            return tags_by_crn
+
+def parse_schedule(name):
+    """Turn weekday-9-18 into (days, start hour, end hour), or None if it is not a valid schedule.
+
+    Hours run from 0 to 24 and must differ; an end hour before the start hour
+    means the window ends the next morning.
+    """
+    try:
+        days, start_hour, end_hour = name.rsplit('-', 2)
+        days, start_hour, end_hour = schedule_days[days], int(start_hour), int(end_hour)
+    except (KeyError, ValueError):
+        return None
+    if not (0 <= start_hour <= 24 and 0 <= end_hour <= 24) or start_hour == end_hour:
+        return None
+    return days, start_hour, end_hour
+
+def in_schedule(days, start_hour, end_hour, now):
+    """Whether now falls in a window opening at start_hour on one of days."""
+    if start_hour < end_hour:
+        return now.weekday() in days and start_hour <= now.hour < end_hour
+    # Overnight window: the evening part on a scheduled day, or the morning after one
+    if now.hour >= start_hour:
+        return now.weekday() in days
+    return now.hour < end_hour and (now.weekday() - 1) % 7 in days
+
+def build_schedule_index(instances, tags_by_crn, resource_groups):
+    """Group instances by schedule name, from their schedule: tag or their resource group.
+
+    resource_groups maps resource group names to the schedule used for instances without a tag.
+    """
+    index = {}
+    for region_name, instance in instances:
+        schedule = next((tag[len(schedule_tag_prefix):] for tag in tags_by_crn.get(instance['crn'], [])
+                         if tag.startswith(schedule_tag_prefix)), None)
+        if schedule is None:
+            schedule = resource_groups.get(instance['resource_group']['name'])
+        if schedule is not None:
+            index.setdefault(schedule, []).append((region_name, instance))
+    return index
+
+def plan_scheduled_actions(index, now):
+    """Decide the action for every indexed instance, evaluating each schedule once."""
+    plan = {'start': [], 'stop': []}
+    for schedule, scheduled in index.items():
+        parsed = parse_schedule(schedule)
+        if parsed is None:
+            print(f"Ignoring {len(scheduled)} instances with unknown schedule {schedule}")
+            continue
+        days, start_hour, end_hour = parsed
+        action = 'start' if in_schedule(days, start_hour, end_hour, now) else 'stop'
+        plan[action].extend(scheduled)
+    return plan
+
+def wait_for_running(executor, pending):
+    """Poll every started instance together until all are running or READY_TIMEOUT passes.
+
+    pending maps instance id to its outcome dict; each is updated in place with
+    ready_seconds (time from the action to running) or a failed/timeout status.
+    One list_instances call per region covers all of that region's pending instances.
+    """
+    started_at = time.perf_counter()
+    deadline = started_at + ready_timeout
+    delay = poll_initial_delay
+    while pending:
+        remaining = deadline - time.perf_counter()
+        if remaining <= 0:
+            break
+        time.sleep(min(delay, remaining))
+        regions = {outcome['region'] for outcome in pending.values()}
+        for future in as_completed([executor.submit(list_region_instances, region) for region in regions]):
+            try:
+                _, region_instances = future.result()
+            except Exception as e:
+                print(f"Failed to poll instances: {e}")
+                continue
+            for instance in region_instances:
+                outcome = pending.get(instance['id'])
+                if not outcome:
+                    continue
+                if instance['status'] == 'running':
+                    outcome['ready_seconds'] = round(time.perf_counter() - outcome['action_at'], 2)
+                    logging.info(f"Instance {instance['id']} is now running")
+                    del pending[instance['id']]
+                elif instance['status'] == 'failed':
+                    outcome['status'] = 'failed'
+                    outcome['error'] = 'instance failed to start'
+                    del pending[instance['id']]
+        if pending:
+            logging.info(f"{len(pending)} instances not running yet, next poll in {min(delay * 2, poll_max_delay)}s")
+        delay = min(delay * 2, poll_max_delay)
+    for outcome in pending.values():
+        outcome['status'] = 'timeout'
+        outcome['error'] = f'not running after {ready_timeout}s'
+    return round(time.perf_counter() - started_at, 2)
+
+def instance_action(run_logger, region_name, instance, action):
+    """Run a stop or start action on one instance and return its outcome."""
+    client = regional_client(region_name)
+    instance_name = instance['name']
+    outcome = {"region": region_name, "id": instance['id'], "name": instance_name, "action": action}
+    start = time.perf_counter()
     try:
-        for region in workloads_regions:
-            vpc_endpoint = region['name']
-            client.set_service_url(f'https://{vpc_endpoint}.iaas.cloud.ibm.com/v1')
-            list_instances = client.list_instances().get_result()['instances']
-            for instance in list_instances:
-                instance_id = instance['id']
-                instance_name = instance['name']
-                if instance_name not in ignore_group:
-                    print(f"Stopping instance {instance_name}")
-                    response = client.create_instance_action(instance_id=instance_id, type='stop').get_result()
-                    send_log_to_ibm_cloud_logs("ce-start-stop-script", "stop-action", f"{instance_name}", f"Stopping instance {instance_name}")
-                    logging.info(response)
+        print(f"{'Stopping' if action == 'stop' else 'Starting'} instance {instance_name}")
+        response = client.create_instance_action(instance_id=instance['id'], type=action).get_result()
+        logging.info(response)
+        outcome["action_at"] = time.perf_counter()
+        outcome["status"] = "ok"
     except ApiException as e:
-        print("Failed to stop instances: %s\n" % e)
+        outcome["status"] = "failed"
+        outcome["error"] = str(e)
+        print(f"Failed to {action} instance {instance_name}: {e}")
+    outcome["seconds"] = round(time.perf_counter() - start, 2)
+    run_logger.log(f"{action}-action", f"{instance_name}",
+                   f"{'Stopping' if action == 'stop' else 'Starting'} instance {instance_name}",
+                   region=region_name, instance_id=instance['id'], status=outcome["status"],
+                   error=outcome.get("error"), seconds=outcome["seconds"])
+    return outcome
+
+def run_instance_actions(action, instances=None):
+    """Apply action to the given (region name, instance) pairs, or every instance, from a bounded worker pool."""
+    start = time.perf_counter()
+    run_logger = RunLogger("ce-start-stop-script")
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        if instances is None:
+            instances = list_all_instances(executor)
+        futures = [executor.submit(instance_action, run_logger, region_name, instance, action)
+                   for region_name, instance in instances if needs_action(instance, action)]
+        outcomes = [future.result() for future in as_completed(futures)]
+        summary = {"action": action, "instances": len(outcomes), "skipped": len(instances) - len(outcomes)}
+        if action == 'start':
+            # All start actions are in flight before any instance is polled
+            started = [outcome for outcome in outcomes if outcome['status'] == 'ok']
+            summary["wait_seconds"] = wait_for_running(executor, {outcome['id']: outcome for outcome in started})
+            ready = [outcome for outcome in started if 'ready_seconds' in outcome]
+            if ready:
+                slowest = max(ready, key=lambda outcome: outcome['ready_seconds'])
+                summary["slowest_instance"] = {"name": slowest['name'], "region": slowest['region'],
+                                               "ready_seconds": slowest['ready_seconds']}
+                if len(ready) == len(outcomes):
+                    summary["all_running_seconds"] = round(time.perf_counter() - start, 2)
+    for outcome in outcomes:
+        outcome.pop('action_at', None)
+    failed = [outcome for outcome in outcomes if outcome['status'] != 'ok']
+    summary.update({
+        "succeeded": len(outcomes) - len(failed),
+        "failed": len(failed),
+        "seconds": round(time.perf_counter() - start, 2)
+    })
+    print(json.dumps(summary))
+    run_logger.close(summary)
+    for outcome in failed:
+        print(json.dumps(outcome))
+    return outcomes
+
+
+@cli.command()
+def stop_vpc_instances():
+    run_instance_actions('stop')
 
 
 @cli.command()
 def start_vpc_instances():
-    client = vpc_client()
-    workloads_regions = client.list_regions().get_result()['regions']
-    try:
-        for region in workloads_regions:
-            vpc_endpoint = region['name']
-            client.set_service_url(f'https://{vpc_endpoint}.iaas.cloud.ibm.com/v1')
-            list_instances = client.list_instances().get_result()['instances']
-            for instance in list_instances:
-                instance_id = instance['id']
-                instance_name = instance['name']
-   
-                print(f"Starting instance {instance_name}")
-                send_log_to_ibm_cloud_logs("ce-start-stop-script", "start-action", f"{instance_name}", f"Starting instance {instance_name}")
-                response = client.create_instance_action(instance_id=instance_id, type='start').get_result()
-                logging.info(response)
-
-                while True:
-                    instance_status = client.get_instance(id=instance_id).get_result()['status']
-                    if instance_status == 'running':
-                        logging.info(f"Instance {instance_id} is now running")
-                        break
-                    else:
-                        logging.info(f"Instance {instance_id} status: {instance_status}. Waiting...")
-                        time.sleep(5) 
-    except ApiException as e:
-        print("Failed to start instances: %s\n" % e)
+    run_instance_actions('start')
+
+
+@cli.command()
+def apply_schedules():
+    """Start or stop each instance according to its schedule tag or resource group schedule."""
+    timezone = ZoneInfo(schedule_timezone)
+    resource_groups = json.loads(schedule_resource_groups)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        tags_future = executor.submit(fetch_instance_tags)
+        instances = list_all_instances(executor)
+        tags_by_crn = tags_future.result()
+    index = build_schedule_index(instances, tags_by_crn, resource_groups)
+    now = datetime.now(timezone)
+    plan = plan_scheduled_actions(index, now)
+    print(json.dumps({
+        "schedules": {schedule: len(scheduled) for schedule, scheduled in index.items()},
+        "evaluated_at": now.isoformat()
+    }))
+    for action in ('stop', 'start'):
+        if plan[action]:
+            run_instance_actions(action, plan[action])
 
 if __name__ == '__main__':
     cli()